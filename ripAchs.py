@@ -3,31 +3,263 @@
 # ripAchs.py - a rewrite of my Perl script for parsing out achievements from xbox.com pages
 #    I did this as an exercise in learning Python.
 #
-# TODO: 
-#    - currently times are read from Xbox.com pages in UTC time, and not
-#        converted to localtime like in my Perl script.  This is due
-#        to the fact I haven't yet been able to find a Python equivalent 
-#        to the DateTime module in Perl.  As a result, toDateTimeObj
-#        is currently unimplemented
+# Times are read from Xbox.com pages in UTC.  out.csv keeps them in UTC, and
+#    the forum post shows them in local time like my Perl script did (see
+#    LocalTime), unless --utc is given.
 
 import sys
 import re
 import glob
 import pprint
 import datetime
+import urlparse
 import urllib
+import httplib
+import socket
+import threading
+import Queue
+import optparse
+import multiprocessing
+import os
+import hashlib
+import struct
+import cPickle
+import mmap
+import contextlib
+import heapq
+import tempfile
+import array
+import itertools
+import multiprocessing.pool
+import logging
+import logging.handlers
+import bisect
+import calendar
+import json
+import time
+
+# NumPy is optional: AchColumns uses it for its sums when it's there
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# so is sqlite3 (some Python builds leave it out): only AchStore needs it
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 # "Constants"
 
 # name of the file to read game icon images from
 GAMESFILE = "games.html"
 
+# files doCSVFile and doForums write to
+CSVFILE = "out.csv"
+FORUMFILE = "out.txt"
+
+# file NDJSONExport appends a JSON record per achievement to (see --ndjson),
+# and the sidecar file it keeps the keys of the records already written in
+NDJSONFILE = "out.ndjson"
+NDJSONINDEXFILE = "out.ndjson.keys"
+
+# fewest HTML files readGameData will start a process pool for
+PARALLEL_MINFILES = 16
+
+# how much of a page probeHeader reads at a time while looking for the header
+PROBE_BLOCK = 64 * 1024
+
+# how much of each file filterPages reads to weed out those that can't be
+# achievement pages, and the markers it looks for: every achievement page's
+# header has the percentage bar, and lists of games (like GAMESFILE) have
+# game titles without one before them
+PREFILTER_BYTES = 32 * 1024
+PAGEMARKER = 'XbcAchPercentageBar'
+LISTMARKER = 'XbcAchievementsTitle'
+
+# file readGameData caches parsed pages in (see ParseCache), and the most
+# pages it will remember
+CACHEFILE = ".ripAchs.cache"
+CACHE_MAXENTRIES = 10000
+
+# SQLite database AchStore keeps the achievement history in (see --db)
+DBFILE = "ripAchs.db"
+
+# file saveSnapshot writes the parsed games to (see --snapshot), what it
+# starts with, and its version: bump this whenever the layout changes
+SNAPSHOTFILE = ".ripAchs.snap"
+SNAPSHOTMAGIC = "ripAchsS"
+SNAPSHOTVERSION = 1
+
+# the snapshot's header: magic, SNAPSHOTVERSION, PARSERVERSION, the
+# pagesFingerprint it was made from, then how many strings, bytes of
+# strings, games and achievements follow (all little-endian)
+SNAPSHOTHEADER = struct.Struct ("<8sHH16sIIII")
+
+# version of what doFile returns: bump this whenever a change to the parsers
+# changes their output, so that existing caches are thrown away
+PARSERVERSION = 3
+
+# HTML character codes replaceHTML decodes, and what they decode to.  Codes
+# were taken from:  http://www.ascii.cl/htmlcodes.htm
+HTMLCODES = {'quot' : '"', 'amp' : chr(38), 'lt' : chr(60), 'gt' : chr(62), 'nbsp' : ' ', 
+    'copy' : chr(169), 'reg' : chr(174), 'iexcl' : chr(161), 'cent' : chr(162),
+    'pound' : chr(163), 'curren' : chr(164), 'yen' : chr(165), 'brvbar' : chr(166), 
+    'sect' : chr(167), 'uml' : chr(168), 'ordf' : chr(170), 'laquo' : chr(171), 
+    'not' : chr(172), 'shy' : chr(173), 'macr' : chr(175), 'deg' : chr(176),  
+    'plusmn' : chr(177), 'sup2' : chr(178), 'sup3' : chr(179), 'acute' : chr(180), 
+    'micro' : chr(181), 'para' : chr(182), 'middot' : chr(183), 'cedil' : chr(184), 
+    'sup1' : chr(185), 'ordm' : chr(186), 'raquo' : chr(187), 'frac14' : chr(188), 
+    'frac12' : chr(189), 'frac34' : chr(190), 'iquest' : chr(191), 'Agrave' : chr(192),
+    'Aacute' : chr(193), 'Acirc' : chr(194), 'Atilde' : chr(195), 'Auml' : chr(196),
+    'Aring' : chr(197), 'AElig' : chr(198), 'Ccedil' : chr(199), 'Egrave' : chr(200),
+    'Eacute' : chr(201), 'Ecirc' : chr(202), 'Euml' : chr(203), 'Igrave' : chr(204),
+    'Iacute' : chr(205), 'Icirc' : chr(206), 'Iuml' : chr(207), 'ETH' : chr(208),
+    'Ntilde' : chr(209), 'Ograve' : chr(210), 'Oacute' : chr(211), 'Ocirc' : chr(212),
+    'Otilde' : chr(213), 'Ouml' : chr(214), 'times' : chr(215), 'Oslash' : chr(216),
+    'Ugrave' : chr(217), 'Uacute' : chr(218), 'Ucirc' : chr(219), 'Uuml' : chr(220),
+    'Yacute' : chr(221), 'THORN' : chr(222), 'szlig' : chr(223), 'agrave' : chr(224),
+    'aacute' : chr(225), 'acirc' : chr(226), 'atilde' : chr(227), 'auml' : chr(228),
+    'aring' : chr(229), 'aelig' : chr(230), 'ccedil' : chr(231), 'egrave' : chr(232),
+    'eacute' : chr(233), 'ecirc' : chr(234), 'euml' : chr(235), 'igrave' : chr(236),
+    'iacute' : chr(237), 'icirc' : chr(238), 'iuml' : chr(239), 'eth' : chr(240),
+    'ntilde' : chr(241), 'ograve' : chr(242), 'oacute' : chr(243), 'ocirc' : chr(244),
+    'otilde' : chr(245), 'ouml' : chr(246), 'divide' : chr(247), 'oslash' : chr(248),
+    'ugrave' : chr(249), 'uacute' : chr(250), 'ucirc' : chr(251), 'uuml' : chr(252),
+    'yacute' : chr(253), 'thorn' : chr(254), 'yuml' : chr(255)}
+
+# matches a single named (&amp;) or numeric (&#38;) HTML character code
+HTMLCODEREGEX = re.compile (r'&(#\d+|[a-zA-Z]\w*);')
+
+# most decoded strings replaceHTML remembers (see g_htmlCache)
+HTMLCACHE_MAXENTRIES = 50000
+
+# characters stripExtraASCII removes from (byte) strings: everything outside
+# the ASCII range 26-126, and the same less the newline, and a RegEx
+# matching them for unicode strings
+EXTRAASCII = ''.join ([chr(c) for c in range (256) if c < 26 or c > 126])
+EXTRAASCII_KEEPNEWLINES = EXTRAASCII.replace ('\n', '')
+EXTRAASCIIREGEX = re.compile (u'[^\x1a-\x7e]+')
+
+# the control characters normTitle removes (it keeps 127-255, so that
+# accented titles don't lose their accented letters)
+CONTROLCHARS = ''.join ([chr(c) for c in range (26)])
+
+# how much of a page parseMapped maps at a time, and how far either side of
+# that it also maps (must be longer than any header or achievement)
+MMAPWINDOW = 4 * 1024 * 1024
+MMAPOVERLAP = 64 * 1024
+
+# most bytes of sorted CSV lines doCSVFile keeps in memory before spilling
+# them to a temporary file
+CSV_MEMBUDGET = 64 * 1024 * 1024
+
+# in --watch mode, how often (in seconds) the directory is checked for new
+# or changed pages, and how long it has to go without changes before the
+# outputs are regenerated (so a burst of saves only regenerates them once)
+WATCH_INTERVAL = 1.0
+WATCH_DEBOUNCE = 2.0
+
+# how many seconds --watch goes on using a gamerscore before fetching it again
+GAMERSCORE_TTL = 15 * 60
+
+# file doForums remembers the last achievement it posted for each game in
+# (when run with --incremental)
+POSTEDFILE = ".ripAchs.posted"
+
+# in --batch mode, how many profiles are processed at once, and the file
+# (next to the manifest) the summary of every profile is written to
+BATCH_WORKERS = 4
+BATCHSUMMARYFILE = "summary.txt"
+
+# where gamercards are fetched from (%s is the gamertag, with spaces as +),
+# and the RegEx that finds the gamerscore on one
+GAMERCARDURL = "http://gamercard.xbox.com/%s.card"
+GSREGEX = re.compile (r'<span class="XbcFRAR">(?P<gs>\d+)<\/span>')
+
+# most requests fetchAll makes at once, how many seconds it waits on one,
+# and how many redirects (responses with these statuses) it follows per URL
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 10
+FETCH_MAXREDIRECTS = 5
+FETCH_REDIRECTS = (301, 302, 303, 307, 308)
+
+# directory ImageCache mirrors achievement and game tile images into, the
+# file in it that maps each URL to its image, and how many images it
+# fetches (and holds in memory) per call to fetchAll
+IMAGECACHEDIR = ".ripAchs.images"
+IMAGEINDEXFILE = "index.json"
+IMAGE_BATCH = 256
+
+# matches an image in the forum post, for mirrorForumPost
+IMGTAGREGEX = re.compile (r'\[IMG\]([^[]*)\[/IMG\]')
+
+# RegEx for matching a game (its tile, then its title) in GAMESFILE
+GAMEDATAREGEX = re.compile (r'<tbody id=".{2}_.{8}"><tr onclick="XbcGetFirstChildHref\(this\);" onMouseOver="XbcNav_swapclass\(this, \'XbcProfileHighlight\', \'\'\);" onMouseOut="XbcNav_swapclass\(this,\'XbcProfileHighlight\',\'\'\);"><td class="XbcAchGameCell"><div class="XbcProfileImageDescCell"><img class="AchievementsGameIcon" src="(http://tiles.xbox.com/tiles/.*.jpg)" alt=".*" /><p><a href="http://live.xbox.com/en-../profile/Achievements/ViewAchievementDetails.aspx\?tid=.*"><strong class="XbcAchievementsTitle">(.*)</strong></a><br /><strong>Last Played Online:')
+
+# file getGameImgs keeps its index of GAMESFILE in, and the version of that
+# index (bump it whenever TileIndex changes)
+TILEINDEXFILE = ".ripAchs.tiles"
+TILEINDEXVERSION = 1
+
 # URL to the icon for the little GS logo
 GICONURL = "http://live.xbox.com/xweb/lib/images/G_Icon_External.gif"
 
-# Global variables used by printIndent()
-g_indent = 0 
-g_verbose = True 
+# the pieces of the forum post doForums writes, with GICONURL filled in once
+# here: a game's header (see headerInfo), each achievement, the game's
+# total for the day, the line between games, and the footer
+FORUMHEADER = '[CENTER]%s[SIZE="3"][b]%s[/b][/SIZE]\n%s / %s (%s%%) achievements for %s / %s' + \
+    '[IMG]' + GICONURL + '[/IMG] (%s%%)[/CENTER]'
+FORUMACH = '[IMG]%s[/IMG]\n[b]%s[/b] - %s (%s [IMG]' + GICONURL + '[/IMG]) (Acquired %s)\n\n'
+FORUMGAMETOTAL = '[SIZE="2"][CENTER]Total GS for day in %s: %s [IMG]' + GICONURL + \
+    '[/IMG][/CENTER][/SIZE]\n\n'
+FORUMSEPARATOR = '[CENTER]------------------------------------[/CENTER]\n\n'
+FORUMFOOTER = '[SIZE="3"][CENTER]Total increase in GS in this update: %s [IMG]' + GICONURL + \
+    '[/IMG]\nNew Total GS: %s [IMG]' + GICONURL + '[/IMG][/CENTER][/SIZE]\n\n'
+
+# number of log records setupLogging buffers before writing them out (any
+# warning or error is written immediately, along with what's buffered)
+LOG_BATCH = 1000
+
+# the script's logger; nothing is printed until setupLogging is called
+g_log = logging.getLogger ("ripAchs")
+g_log.addHandler (logging.NullHandler())
+
+# name of the page parser doFile uses by default (a key of PARSERS)
+g_engine = "stream"
+
+# whether doFile memory maps pages instead of reading them (see mapHTML)
+g_mmap = False
+
+# number of worker processes readGameData parses files with, and how many
+# files are handed to a worker at a time (0 picks a chunk size from the
+# number of files)
+g_workers = multiprocessing.cpu_count()
+g_chunksize = 0
+
+# whether readGameData uses a ParseCache, and how many pages it may hold
+g_cache = True
+g_cacheSize = CACHE_MAXENTRIES
+
+# gamertag whose gamerscore goes at the bottom of the forum post
+g_gamertag = "Pedle Zelnip"
+
+# whether doForums shows unlock times in UTC rather than local time
+g_utc = False
+
+# whether doForums only posts achievements newer than those already posted
+g_incremental = False
+
+# memory budget doCSVFile sorts within (see CSV_MEMBUDGET)
+g_csvBudget = CSV_MEMBUDGET
+
+# strings replaceHTML has already decoded, mapped to (decoded form, number
+# of character codes)
+g_htmlCache = {}
+
+# the RunStats being recorded into while --stats is on, otherwise None
+g_stats = None
 
 #
 # genKeyFromGameTitle (title) - generates a hash key from the game title stored in title
@@ -59,96 +291,387 @@ def commify (num):
 def getHTML (filename):
     """ returns the contents of the HTML file as one big string """
     f = open (filename, 'r')
-    return f.read()
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+#
+# mapHTML (fileName) - context manager that memory maps the HTML file fileName
+#    (read only) for the duration of the with block, so it can be searched
+#    like a string without first being read into memory.  Slicing the map
+#    or matching a RegEx against it only copies out the parts asked for.
+#    The map and the file are closed when the block exits; an empty file
+#    (which can't be mapped) gives an empty string.
+#
+@contextlib.contextmanager
+def mapHTML (filename):
+    f = open (filename, 'rb')
+    try:
+        if os.fstat (f.fileno()).st_size == 0:
+            yield ''
+        else:
+            m = mmap.mmap (f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield m
+            finally:
+                m.close()
+    finally:
+        f.close()
 
 #
 # stripExtraASCII (str) - removes all characters from str that are not in
-#    the ASCII range of 26 through 126 (inclusive)
+#    the ASCII range of 26 through 126 (inclusive).  str may be a str,
+#    bytearray or unicode string, and the result is of the same type
 #
 def stripExtraASCII (s):
     """ removes all characters from the supplied string that are not in the ASCII range 26-126 (inclusive)"""
-    # functional programming is beautiful
-    return reduce (lambda x,y: x + y, 
-        filter (lambda x: ord(x) >= 26 and ord(x) <= 126, list (s)))
+    if isinstance (s, unicode):
+        return EXTRAASCIIREGEX.sub (u'', s)
 
-    # alternatively could've done a list comprehension:
-    # return "".join ([c for c in list(s) if ord(c) >= 26 and ord(c) <= 126])
+    # one pass over s with a precomputed deletion table
+    return s.translate (None, EXTRAASCII)
 
-def getGameImgs():
-    gameDataRegex = r'<tbody id=".{2}_.{8}"><tr onclick="XbcGetFirstChildHref\(this\);" onMouseOver="XbcNav_swapclass\(this, \'XbcProfileHighlight\', \'\'\);" onMouseOut="XbcNav_swapclass\(this,\'XbcProfileHighlight\',\'\'\);"><td class="XbcAchGameCell"><div class="XbcProfileImageDescCell"><img class="AchievementsGameIcon" src="(http://tiles.xbox.com/tiles/.*.jpg)" alt=".*" /><p><a href="http://live.xbox.com/en-../profile/Achievements/ViewAchievementDetails.aspx\?tid=.*"><strong class="XbcAchievementsTitle">(.*)</strong></a><br /><strong>Last Played Online:'
+#
+# stripExtraASCIIList (strs) - returns a list of the strings in strs with
+#    stripExtraASCII applied to each.  Lists of (byte) strings without any
+#    newlines (such as game titles) are joined up and cleaned in a single pass
+#
+def stripExtraASCIIList (strs):
+    if not strs:
+        return []
 
-    games = {}
-    for match in re.findall (gameDataRegex, getHTML (GAMESFILE)):
-        games[genKeyFromGameTitle(match[1])] = match[0]
+    joined = '\n'.join (strs)
+    if isinstance (joined, unicode) or joined.count ('\n') != len (strs) - 1:
+        return [stripExtraASCII (s) for s in strs]
+    return joined.translate (None, EXTRAASCII_KEEPNEWLINES).split ('\n')
 
-    return games 
     
 #
-# printIndent (msg) - prints msg to STDOUT, prepending the message with
-#    an indent based upon the global g_indent variable if g_verbose
-#    is True.  If verbose is False, then nothing is output to STDOUT 
+# LogIndent - a logging filter that prefixes each record's message with four
+#    "."s per level of indentation, as record.indent.  Entering it as a
+#    context manager indents everything logged inside the with block by one
+#    more level.  The depth is kept per thread.
+#
+class LogIndent (logging.Filter):
+    def __init__ (self):
+        logging.Filter.__init__ (self)
+        self.local = threading.local()
+
+    def depth (self):
+        return getattr (self.local, "depth", 0)
+
+    def filter (self, record):
+        record.indent = "...." * self.depth()
+        return True
+
+    def __enter__ (self):
+        self.local.depth = self.depth() + 1
+        return self
+
+    def __exit__ (self, *excInfo):
+        self.local.depth -= 1
+        return False
+
+g_logIndent = LogIndent()
+
+#
+# logIndented (func) - decorator that runs func inside g_logIndent, so
+#    everything it logs is indented one level
+#
+def logIndented (func):
+    def wrapper (*args, **kwargs):
+        with g_logIndent:
+            return func (*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+#
+# LogBatch (stream) - a logging handler that holds records until LOG_BATCH
+#    of them (or a warning) arrive, then writes them all to stream in one go
+#
+class LogBatch (logging.handlers.MemoryHandler):
+    def __init__ (self, stream):
+        logging.handlers.MemoryHandler.__init__ (self, LOG_BATCH,
+            flushLevel=logging.WARNING)
+        self.stream = stream
+
+    def flush (self):
+        self.acquire()
+        try:
+            if self.buffer:
+                self.stream.write ("".join ([self.format (record) + "\n"
+                    for record in self.buffer]))
+                self.stream.flush()
+                self.buffer = []
+        finally:
+            self.release()
+
+#
+# setupLogging (level, stream) - prints g_log's records of at least level to
+#    stream (default STDOUT), indented by g_logIndent.  Records are written
+#    in batches (see LogBatch) so that a verbose run doesn't spend its time
+#    waiting on the terminal; whatever is left is written at exit.  Messages
+#    below level are never formatted.
+#
+def setupLogging (level=logging.INFO, stream=None):
+    handler = LogBatch (stream or sys.stdout)
+    handler.setFormatter (logging.Formatter ("%(indent)s%(message)s"))
+    handler.addFilter (g_logIndent)
+    g_log.addHandler (handler)
+    g_log.setLevel (level)
+    g_log.propagate = False
+    return handler
+
+#
+# flushLog () - writes out whatever g_log's handlers are holding back, for
+#    long running modes that can't wait for exit (see Watcher.run)
+#
+def flushLog ():
+    for handler in g_log.handlers:
+        handler.flush()
+
+class RunStats (object):
+    '''
+    Wall and CPU time, and counts of the items processed, for each stage of
+    a run (see statStage and statCount).  Stages are named by the caller
+    and may be nested or entered many times, their times adding up; counts
+    go to the innermost stage being timed as well as to the run's totals.
+    Each page parsed gets its own report too (see doFileStats), which works
+    the same whether it was parsed here or in a worker process.
+    '''
+    def __init__ (self):
+        self.startWall = time.time()
+        self.startCPU = time.clock()
+        self.order = []     # stage names, in the order they were first entered
+        self.stages = {}
+        self.active = []
+        self.counts = {}
+        self.files = {}
+
+    def record (self, name, wall, cpu, calls=1):
+        stage = self.stages.get (name)
+        if stage is None:
+            stage = self.stages[name] = {"wall" : 0.0, "cpu" : 0.0, "calls" : 0, "counts" : {}}
+            self.order.append (name)
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        stage["calls"] += calls
+        return stage
+
+    @contextlib.contextmanager
+    def stage (self, name):
+        self.record (name, 0.0, 0.0, 0)
+        self.active.append (name)
+        (wall, cpu) = (time.time(), time.clock())
+        try:
+            yield self
+        finally:
+            self.record (name, time.time() - wall, time.clock() - cpu)
+            self.active.pop()
+
+    def count (self, name, n=1):
+        self.counts[name] = self.counts.get (name, 0) + n
+        if self.active:
+            counts = self.stages[self.active[-1]]["counts"]
+            counts[name] = counts.get (name, 0) + n
+
+    def addFile (self, file, report):
+        self.files[file] = report
+        self.record ("parse", report["wall"], report["cpu"])
+        for stage in report["stages"]:
+            counts = self.record (stage["name"], stage["wall"], stage["cpu"], stage["calls"])["counts"]
+            for (name, n) in stage["counts"].iteritems():
+                counts[name] = counts.get (name, 0) + n
+        for (name, n) in report["counts"].iteritems():
+            self.count (name, n)
+
+    def report (self):
+        stages = []
+        for name in self.order:
+            stage = dict (self.stages[name])
+            stage["name"] = name
+            stages.append (stage)
+        return {"wall" : time.time() - self.startWall, "cpu" : time.clock() - self.startCPU,
+            "counts" : self.counts, "stages" : stages}
+
+    def save (self, filename):
+        report = self.report()
+        report["files"] = self.files
+        f = open (filename, 'w')
+        try:
+            json.dump (report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+#
+# NoStage - what statStage hands back while stats are off: a context
+#    manager that does nothing
+#
+class NoStage (object):
+    def __enter__ (self):
+        return None
+
+    def __exit__ (self, *excInfo):
+        return False
+
+NOSTAGE = NoStage()
+
+#
+# statStage (name) - returns a context manager that times the code run
+#    inside it as the stage name of g_stats, or does nothing if stats are off
+#
+def statStage (name):
+    if g_stats:
+        return g_stats.stage (name)
+    return NOSTAGE
+
+#
+# statCount (name, n) - adds n to the count name in g_stats, if stats are on
 #
-def printIndent (msg):
-    if g_verbose :
-        s_indent = ""
-        for dummy in range(g_indent * 4):
-            s_indent = s_indent + "."
-        s_indent = s_indent + msg
-        print s_indent 
+def statCount (name, n=1):
+    if g_stats:
+        g_stats.count (name, n)
+
+#
+# decodeHTMLCode (match) - returns the character for a single HTML character
+#    code matched by HTMLCODEREGEX.  Named codes not in HTMLCODES, and numeric
+#    codes outside the range chr() can produce (0-255), are returned unchanged
+#
+def decodeHTMLCode (match):
+    code = match.group (1)
+    if code[0] == '#':
+        n = int (code[1:])
+        if n < 256:
+            return chr (n)
+        return match.group (0)
+    return HTMLCODES.get (code, match.group (0))
 
 #
 # replaceHTML (str) - replaces all HTML character codes (such as &amp; or 
-#    &38;) found in str with ASCII character code equivalents.  For named
-#    character codes, all standard codes in the standard ASCII range are 
-#    recognized.  For numeric codes, the numeric value is parsed and passed
-#    as an argument to Python's chr() routine.  NO CHECKS ARE DONE TO ENSURE
-#    that numeric values are sensible (thus an HTML code of &9999999999; 
-#    would result in a call to chr(9999999999))
-#
-#    Codes were taken from:
-#    http://www.ascii.cl/htmlcodes.htm
+#    &#38;) found in str with their character equivalents (see HTMLCODES and
+#    decodeHTMLCode), in a single scan over str.  Titles and descriptions
+#    repeat a lot between pages, so decoded strings are remembered in
+#    g_htmlCache, along with how many codes they had (the cache is emptied
+#    once it holds HTMLCACHE_MAXENTRIES strings).  The codes are counted as
+#    entitiesDecoded on every call, whether the string was cached or not,
+#    so the count doesn't depend on what the cache held
 # 
 def replaceHTML (str):
-    # HTML character codes to replace
-    codes = {'quot' : '"', 'amp' : chr(38), 'lt' : chr(60), 'gt' : chr(62), 'nbsp' : ' ', 
-        'copy' : chr(169), 'reg' : chr(174), 'iexcl' : chr(161), 'cent' : chr(162),
-        'pound' : chr(163), 'curren' : chr(164), 'yen' : chr(165), 'brvbar' : chr(166), 
-        'sect' : chr(167), 'uml' : chr(168), 'ordf' : chr(170), 'laquo' : chr(171), 
-        'not' : chr(172), 'shy' : chr(173), 'macr' : chr(175), 'deg' : chr(176),  
-        'plusmn' : chr(177), 'sup2' : chr(178), 'sup3' : chr(179), 'acute' : chr(180), 
-        'micro' : chr(181), 'para' : chr(182), 'middot' : chr(183), 'cedil' : chr(184), 
-        'sup1' : chr(185), 'ordm' : chr(186), 'raquo' : chr(187), 'frac14' : chr(188), 
-        'frac12' : chr(189), 'frac34' : chr(190), 'iquest' : chr(191), 'Agrave' : chr(192),
-        'Aacute' : chr(193), 'Acirc' : chr(194), 'Atilde' : chr(195), 'Auml' : chr(196),
-        'Aring' : chr(197), 'AElig' : chr(198), 'Ccedil' : chr(199), 'Egrave' : chr(200),
-        'Eacute' : chr(201), 'Ecirc' : chr(202), 'Euml' : chr(203), 'Igrave' : chr(204),
-        'Iacute' : chr(205), 'Icirc' : chr(206), 'Iuml' : chr(207), 'ETH' : chr(208),
-        'Ntilde' : chr(209), 'Ograve' : chr(210), 'Oacute' : chr(211), 'Ocirc' : chr(212),
-        'Otilde' : chr(213), 'Ouml' : chr(214), 'times' : chr(215), 'Oslash' : chr(216),
-        'Ugrave' : chr(217), 'Uacute' : chr(218), 'Ucirc' : chr(219), 'Uuml' : chr(220),
-        'Yacute' : chr(221), 'THORN' : chr(222), 'szlig' : chr(223), 'agrave' : chr(224),
-        'aacute' : chr(225), 'acirc' : chr(226), 'atilde' : chr(227), 'auml' : chr(228),
-        'aring' : chr(229), 'aelig' : chr(230), 'ccedil' : chr(231), 'egrave' : chr(232),
-        'eacute' : chr(233), 'ecirc' : chr(234), 'euml' : chr(235), 'igrave' : chr(236),
-        'iacute' : chr(237), 'icirc' : chr(238), 'iuml' : chr(239), 'eth' : chr(240),
-        'ntilde' : chr(241), 'ograve' : chr(242), 'oacute' : chr(243), 'ocirc' : chr(244),
-        'otilde' : chr(245), 'ouml' : chr(246), 'divide' : chr(247), 'oslash' : chr(248),
-        'ugrave' : chr(249), 'uacute' : chr(250), 'ucirc' : chr(251), 'uuml' : chr(252),
-        'yacute' : chr(253), 'thorn' : chr(254), 'yuml' : chr(255)}
-
-    for (code, val) in codes.iteritems():
-        str = re.sub ('&' + code + ';', val, str)
-
-    # replace all &#1234; style codes, and return the result
-    return re.sub (r'&#(?P<numId>\d+);', lambda matchobj: chr(matchobj.group('numId')), str) 
+    if '&' not in str:
+        return str
+
+    cached = g_htmlCache.get (str)
+    if cached is None:
+        cached = HTMLCODEREGEX.subn (decodeHTMLCode, str)
+        if len (g_htmlCache) >= HTMLCACHE_MAXENTRIES:
+            g_htmlCache.clear()
+        g_htmlCache[str] = cached
+    statCount ("entitiesDecoded", cached[1])
+    return cached[0]
+
+#
+# replaceHTMLList (strs) - returns a list of the strings in strs with their
+#    HTML character codes replaced, as replaceHTML does.  All the strings that
+#    aren't already in g_htmlCache are joined up and decoded with one scan
+#
+def replaceHTMLList (strs):
+    todo = [s for s in set (strs) if '&' in s and s not in g_htmlCache]
+
+    # the separator can't appear inside a character code, so the decoded
+    # string splits back up into exactly the same pieces
+    joined = '\0'.join (todo)
+    if todo and joined.count ('\0') == len (todo) - 1:
+        if len (g_htmlCache) + len (todo) > HTMLCACHE_MAXENTRIES:
+            g_htmlCache.clear()
+
+        # note where each code starts, to count them per string
+        starts = []
+        def decode (match):
+            starts.append (match.start())
+            return decodeHTMLCode (match)
+        decoded = HTMLCODEREGEX.sub (decode, joined).split ('\0')
+
+        counts = [0] * len (todo)
+        (i, end) = (0, len (todo[0]))
+        for start in starts:
+            while start > end:
+                i += 1
+                end += len (todo[i]) + 1
+            counts[i] += 1
+        g_htmlCache.update (zip (todo, zip (decoded, counts)))
+
+    return [replaceHTML (s) for s in strs]
+
+#
+# utcOffset (ts) - returns the local timezone's offset from UTC (in seconds,
+#    positive east of Greenwich) at the UTC time ts (seconds since the epoch)
+#
+def utcOffset (ts):
+    return calendar.timegm (time.localtime (ts)) - ts
+
+class LocalTime (object):
+    '''
+    Converts UTC times (in seconds since the epoch) to local time.  The local
+    UTC offset is looked up once per day for the range of days given
+    (start to end, as UTC times) and kept in a table; only days on which the
+    offset changes (daylight saving starting or ending), and times outside
+    the range, are worked out individually.  With utc set no conversion is
+    done at all.  Formatted times are remembered per minute, since many
+    achievements share one.
+    '''
+
+    def __init__ (self, start=0, end=-1, utc=False):
+        self.utc = utc
+        self.firstDay = start // 86400
+        self.offsets = array.array ('i')
+        self.changeDays = set()
+        self.formatted = {}
+
+        if not utc:
+            for day in xrange (self.firstDay, end // 86400 + 1):
+                dayStart = day * 86400
+                self.offsets.append (utcOffset (dayStart))
+                if utcOffset (dayStart + 86399) != self.offsets[-1]:
+                    self.changeDays.add (day)
+
+    def offset (self, ts):
+        ''' returns the local UTC offset (in seconds) at the UTC time ts '''
+        if self.utc:
+            return 0
+        day = ts // 86400
+        i = day - self.firstDay
+        if 0 <= i < len (self.offsets) and day not in self.changeDays:
+            return self.offsets[i]
+        return utcOffset (ts)
+
+    def toLocal (self, ts):
+        ''' returns the UTC time ts as a (naive) datetime in local time '''
+        return datetime.datetime.utcfromtimestamp (ts + self.offset (ts))
+
+    def format (self, ts):
+        ''' returns the UTC time ts as a local time formatted as MMMM DD, YYYY at H:MM AMPM '''
+        minute = ts // 60
+        s = self.formatted.get (minute)
+        if s is None:
+            s = self.formatted[minute] = self.toLocal (minute * 60).strftime ("%B %d, %Y at %I:%M%p")
+        return s
 
 #
 # toDateTimeObj (day, month, year, hour, minute) - converts the supplied UTC timezone 
 #    values into a datetime object in the local timezone. 
 #
 def toDateTimeObj (day, month, year, hour, minute): 
-#    dtobj = datetime.datetime (year, month, day, hour, minute)
-    return "42"
+    ts = calendar.timegm ((int (year), int (month), int (day), int (hour), int (minute), 0))
+    return datetime.datetime.utcfromtimestamp (ts + utcOffset (ts))
+
+#
+# utcDate (ts) - formats the UTC time ts (seconds since the epoch) as
+#    YYYY MM DD HH:MM:00, the date format used in out.csv
+#
+def utcDate (ts):
+    return '%d %02d %02d %02d:%02d:00' % time.gmtime (ts)[:5]
 
 #
 # padZero (n) - pads the string n with a 0 to make it a 2 character string.
@@ -160,8 +683,284 @@ def padZero (n) :
     return n.rjust (2, "0") 
 
 #
-# doFile (filename) - parses the achievements out of the supplied xbox.com 
-#    formatted HTML file named filename.  Returns a hash that contains:
+# RegExes for matching the header/game info and an individual achievement.
+#    HEADERPATTERN is everything in the header from the "Achievements" heading
+#    onwards; TITLEREGEX prefixes it with the title span.  ACHPATTERN has a
+#    slot for the part of the icon URL between the tiles path and ".jpg".
+#
+HEADERPATTERN = r'Achievements</h2></div><div class="XbcAchPercentageBar"><div><div style="width:\d+%;"></div></div><p>(?P<percent>\d+)% Unlocked</p></div></div><div class="XbcProfileSubHead"><p class="XbcFloatLeft"><strong>(?P<gs>\d+) of (?P<gstotal>\d+)\s<img src="/xweb/lib/images/G_Icon_External.gif" /></strong><br /><strong>(?P<achCount>\d+) of (?P<achTotal>\d+) Achievements</strong></p><div class="XbcFloatClear"></div></div><div class="XbcProfileTableContainer"><table class="XbcProfileTable XbcAchievementsDetailsTable" cellpadding="0" cellspacing="0"><thead><tr class="XbcTableColumns"><th class="XbcAchCol1"><span class="XbcDisplayNone">Achievements </span></th><th class="XbcAchCol2"><span class="XbcDisplayNone">Gamerscore </span></th></tr></thead>'
+
+ACHPATTERN = r'<tbody\sid="ad_.?.?"><tr><td class="XbcAchDescription"><div class="XbcProfileImageDescCell"><img src="(http://tiles.xbox.com/tiles/%s.jpg)" /><p><strong class="XbcAchievementsTitle">(.*?)\n?</strong><br />(.*?)\n?</p></div></td><td class="XbcAchGamerData"><strong>(\d+) <img src="/xweb/lib/images/G_Icon_External.gif" /></strong><br /><strong>Acquired <script type="text/javascript">\n\s+<!--\n\s+_xbcDisplayDate\((\d+),\s(\d+),\s(\d+),\s(\d+),\s(\d+)\);\n\s+--></script><noscript>\d\d?/\d\d?/\d\d\d\d</noscript></strong></td></tr></tbody>'
+
+TITLEREGEX = re.compile (r'.*<span class="XbcLiveText">(?P<title>.*?)</span>.*' + HEADERPATTERN)
+ACHREGEX = re.compile (ACHPATTERN % '.*')
+
+# The streaming parser finds the header markers with a plain string search
+#    and only tries HEADERREGEX (anchored) at that one position, and scans for
+#    achievements with ACHBODYREGEX, whose image URL can't run past its
+#    quotes; neither has a leading .* to backtrack over
+LIVETEXTTAG = '<span class="XbcLiveText">'
+HEADERMARKER = 'Achievements</h2></div><div class="XbcAchPercentageBar">'
+HEADERREGEX = re.compile (HEADERPATTERN)
+ACHBODYREGEX = re.compile (ACHPATTERN % '[^"\\n]*')
+
+#
+# makeGameData (title, percent, gs, gstotal, achCount, achTotal) - builds the
+#    game info hash returned by doFile from the raw (undecoded) header fields
+#
+def makeGameData (title, percent, gs, gstotal, achCount, achTotal):
+    return {"title" : stripExtraASCII (title),
+        "percent" : percent,
+        "gs" : gs,
+        "gstotal" : gstotal,
+        "achCount" : achCount,
+        "achTotal" : achTotal,
+        "key" : genKeyFromGameTitle (title)}
+
+class Achievement (object):
+    '''
+    A single unlocked achievement, as returned by doFile.  The gamerscore is
+    stored as an int, the unlock time as a single int (ts, UTC seconds since
+    the epoch), and the strings are interned, since the same names and
+    descriptions turn up in every saved copy of a page.  For compatibility
+    with the hashes doFile used to return, an Achievement can also be read
+    like one: ach["name"], ach["month"] (a 2-digit UTC month), ach["date"]
+    and so on (see KEYS).
+    '''
+    __slots__ = ('name', 'img', 'desc', 'gs', 'tcount', 'ts')
+
+    # the keys an Achievement can be read with, and how each one is worked out
+    KEYS = {'name' : lambda a: a.name,
+        'img' : lambda a: a.img,
+        'desc' : lambda a: a.desc,
+        'gs' : lambda a: str (a.gs),
+        'tcount' : lambda a: a.tcount,
+        'ts' : lambda a: a.ts,
+        'year' : lambda a: str (time.gmtime (a.ts).tm_year),
+        'month' : lambda a: '%02d' % time.gmtime (a.ts).tm_mon,
+        'day' : lambda a: '%02d' % time.gmtime (a.ts).tm_mday,
+        'hour' : lambda a: '%02d' % time.gmtime (a.ts).tm_hour,
+        'min' : lambda a: '%02d' % time.gmtime (a.ts).tm_min,
+        'date' : lambda a: utcDate (a.ts)}
+
+    def __init__ (self, name, img, desc, gs, tcount, ts):
+        self.name = intern (name)
+        self.img = intern (img)
+        self.desc = intern (desc)
+        self.gs = gs
+        self.tcount = tcount
+        self.ts = ts
+
+    def fields (self):
+        ''' returns the stored fields as a tuple, in the order the constructor takes them '''
+        return (self.name, self.img, self.desc, self.gs, self.tcount, self.ts)
+
+    def __getitem__ (self, key):
+        return self.KEYS[key] (self)
+
+    def get (self, key, default=None):
+        if key in self.KEYS:
+            return self.KEYS[key] (self)
+        return default
+
+    def __contains__ (self, key):
+        return key in self.KEYS
+
+    def keys (self):
+        return self.KEYS.keys()
+
+    def __eq__ (self, other):
+        return isinstance (other, Achievement) and self.fields() == other.fields()
+
+    def __ne__ (self, other):
+        return not self == other
+
+    def __hash__ (self):
+        return hash (self.fields())
+
+    def __reduce__ (self):
+        return (Achievement, self.fields())
+
+    def __repr__ (self):
+        return 'Achievement%r' % (self.fields(),)
+
+#
+# makeAch (tcount, img, name, desc, gs, month, day, year, hour, min) - builds
+#    a single Achievement (see doFile) from the fields matched out of the
+#    page, with name and desc already decoded.  month is the 0-based month
+#    passed to _xbcDisplayDate()
+#
+def makeAch (tcount, img, name, desc, gs, month, day, year, hour, min):
+    return Achievement (name, img, desc, int (gs), tcount, calendar.timegm ((int (year),
+        int (month) + 1, int (day), int (hour), int (min), 0)))
+
+#
+# makeAchList (fieldsList) - builds the list of achievement hashes for a page
+#    from the raw fields matched for each achievement (in page order),
+#    decoding all the names and descriptions in one go with replaceHTMLList
+#
+def makeAchList (fieldsList):
+    count = len (fieldsList)
+    with statStage ("decode"):
+        decoded = replaceHTMLList ([fields[1] for fields in fieldsList] + \
+            [fields[2] for fields in fieldsList])
+
+    achList = []
+    tcount = 999    # for in case there are achs with same date/time
+    for i in xrange (count):
+        tcount = tcount - 1
+        fields = fieldsList[i]
+        achList.append (makeAch (tcount, fields[0], decoded[i],
+            decoded[count + i], *fields[3:]))
+    return achList
+
+#
+# parseRegex (html) - the original page parser: finds the header with
+#    TITLEREGEX and then every achievement with ACHREGEX.  Returns the
+#    same (gameData, achList) pair as doFile
+#
+def parseRegex (html):
+    achList = []
+    gameData = {}
+
+    # read general game data
+    match = TITLEREGEX.search (html)
+    if match : 
+        gameData = makeGameData (match.group ('title'), match.group ('percent'),
+            match.group ('gs'), match.group ('gstotal'),
+            match.group ('achCount'), match.group ('achTotal'))
+
+        achList = makeAchList (ACHREGEX.findall (html))
+            
+    return (gameData, achList)
+
+#
+# findHeader (html, pos, end) - looks for the game header starting anywhere
+#    from pos up to (but not including) end.  Returns (match, title) where
+#    match is the HEADERREGEX match and title is the raw game title, taken
+#    from the last XbcLiveText span on the same line (which is what the
+#    leading .* in TITLEREGEX ends up selecting), or (None, None)
+#
+def findHeader (html, pos, end):
+    markerEnd = end + len (HEADERMARKER) - 1
+    pos = html.find (HEADERMARKER, pos, markerEnd)
+    while pos >= 0:
+        match = HEADERREGEX.match (html, pos)
+        if match:
+            lineStart = html.rfind ('\n', 0, pos) + 1
+            titleStart = html.rfind (LIVETEXTTAG, lineStart, pos)
+            while titleStart >= 0:
+                titleEnd = html.find ('</span>', titleStart, pos)
+                if titleEnd >= 0:
+                    return (match, html[titleStart + len (LIVETEXTTAG):titleEnd])
+                titleStart = html.rfind (LIVETEXTTAG, lineStart, titleStart)
+        pos = html.find (HEADERMARKER, pos + 1, markerEnd)
+    return (None, None)
+
+#
+# findAchFields (html, pos, end, achFields) - appends the raw fields of each
+#    achievement that starts anywhere from pos up to (but not including) end
+#    to achFields.  The achievements are found with a single finditer scan
+#    rather than a find and a match per <tbody>, so the per-achievement work
+#    stays in C.  Returns where scanning should carry on from: end, or the
+#    end of the last achievement if that runs past end
+#
+def findAchFields (html, pos, end, achFields):
+    last = pos
+    for m in ACHBODYREGEX.finditer (html, pos):
+        if m.start() >= end:
+            break
+        achFields.append (m.groups())
+        last = m.end()
+    return max (last, end)
+
+#
+# parseStream (html) - single pass page parser.  Walks the page once from
+#    front to back: first to the header (see findHeader), and then from one
+#    achievement to the next (see findAchFields).  Returns the same
+#    (gameData, achList) pair as parseRegex
+#
+def parseStream (html):
+    achList = []
+    gameData = {}
+
+    # read general game data
+    (match, title) = findHeader (html, 0, len (html))
+    if match:
+        gameData = makeGameData (title, match.group ('percent'),
+            match.group ('gs'), match.group ('gstotal'),
+            match.group ('achCount'), match.group ('achTotal'))
+
+        achFields = []
+        findAchFields (html, match.end(), len (html), achFields)
+        achList = makeAchList (achFields)
+
+    return (gameData, achList)
+
+#
+# parseMapped (filename) - parses the page in filename the same way as
+#    parseStream, but straight off disk through a memory map that is moved
+#    along the file MMAPWINDOW bytes at a time (plus MMAPOVERLAP bytes either
+#    side, so a header or achievement crossing the edge of a window is still
+#    seen whole).  Only one window is ever mapped, so memory use doesn't grow
+#    with the size of the page, and only the matched fields are copied out
+#
+def parseMapped (filename):
+    achList = []
+    gameData = {}
+    achFields = []
+
+    f = open (filename, 'rb')
+    try:
+        size = os.fstat (f.fileno()).st_size
+        pos = 0
+        while pos < size:
+            mapStart = max (0, pos - MMAPOVERLAP)
+            mapStart = mapStart - mapStart % mmap.ALLOCATIONGRANULARITY
+            mapEnd = min (size, pos + MMAPWINDOW + MMAPOVERLAP)
+
+            # positions below are relative to the start of the map, and only
+            # things starting before end belong to this window
+            end = min (size, pos + MMAPWINDOW) - mapStart
+            html = mmap.mmap (f.fileno(), mapEnd - mapStart,
+                access=mmap.ACCESS_READ, offset=mapStart)
+            try:
+                local = pos - mapStart
+                if not gameData:
+                    (match, title) = findHeader (html, local, end)
+                    if match:
+                        gameData = makeGameData (title, match.group ('percent'),
+                            match.group ('gs'), match.group ('gstotal'),
+                            match.group ('achCount'), match.group ('achTotal'))
+                        local = match.end()
+                    else:
+                        local = end
+
+                if gameData:
+                    local = findAchFields (html, local, end, achFields)
+            finally:
+                html.close()
+
+            pos = mapStart + max (local, end)
+    finally:
+        f.close()
+
+    if gameData:
+        achList = makeAchList (achFields)
+    return (gameData, achList)
+
+# the page parsers doFile can use, selected by name (see g_engine), and
+# those that can work on a file directly when asked to memory map it
+PARSERS = {"regex" : parseRegex, "stream" : parseStream}
+MAPPEDPARSERS = {"stream" : parseMapped}
+
+#
+# doFile (filename, engine) - parses the achievements out of the supplied xbox.com 
+#    formatted HTML file named filename, using the parser named by engine
+#    (one of the keys of PARSERS, defaults to g_engine).  If mapped (defaults
+#    to g_mmap) is set the file is memory mapped rather than read into one
+#    big string first: piece by piece if the engine is in MAPPEDPARSERS,
+#    otherwise as a whole with mapHTML.  Returns a hash that contains:
 #
 #    title => the game's title
 #    percent => the current gs completion percentage
@@ -170,8 +969,8 @@ def padZero (n) :
 #    achCount => current number of earned achievements for the game
 #    achTotal => total possible achievements for the game (incl DLC) 
 #
-#    Also returns a list of hashes, with each hash 
-#    representing a single achievement with:
+#    Also returns a list of Achievements, each of which can be read like a
+#    hash representing a single achievement with:
 #
 #    name => The achievement name
 #    desc => the achievement description
@@ -186,125 +985,1009 @@ def padZero (n) :
 #    hour => the 24-hour clock UTC hour the achievement was unlocked
 #    min => the 2-digit UTC minute the achievement was unlocked
 #    img => a URL to the icon image associated with the achievement
+#    ts => the UTC time the achievement was unlocked, in seconds since the epoch
 #
-def doFile (file):
-    # RegEx for matching an individual achievement
-    achRegex = r'<tbody\sid="ad_.?.?"><tr><td class="XbcAchDescription"><div class="XbcProfileImageDescCell"><img src="(http://tiles.xbox.com/tiles/.*.jpg)" /><p><strong class="XbcAchievementsTitle">(.*?)\n?</strong><br />(.*?)\n?</p></div></td><td class="XbcAchGamerData"><strong>(\d+) <img src="/xweb/lib/images/G_Icon_External.gif" /></strong><br /><strong>Acquired <script type="text/javascript">\n\s+<!--\n\s+_xbcDisplayDate\((\d+),\s(\d+),\s(\d+),\s(\d+),\s(\d+)\);\n\s+--></script><noscript>\d\d?/\d\d?/\d\d\d\d</noscript></strong></td></tr></tbody>'
+def doFile (file, engine=None, mapped=None):
+    engine = engine or g_engine
+    if mapped is None:
+        mapped = g_mmap
+
+    if mapped and engine in MAPPEDPARSERS:
+        return MAPPEDPARSERS[engine] (file)
+    if mapped:
+        with mapHTML (file) as html:
+            return PARSERS[engine] (html)
+    return PARSERS[engine] (getHTML (file))
 
-    # RegEx for matching the header/game info
-    titleRegex = r'.*<span class="XbcLiveText">(?P<title>.*?)</span>.*Achievements</h2></div><div class="XbcAchPercentageBar"><div><div style="width:\d+%;"></div></div><p>(?P<percent>\d+)% Unlocked</p></div></div><div class="XbcProfileSubHead"><p class="XbcFloatLeft"><strong>(?P<gs>\d+) of (?P<gstotal>\d+)\s<img src="/xweb/lib/images/G_Icon_External.gif" /></strong><br /><strong>(?P<achCount>\d+) of (?P<achTotal>\d+) Achievements</strong></p><div class="XbcFloatClear"></div></div><div class="XbcProfileTableContainer"><table class="XbcProfileTable XbcAchievementsDetailsTable" cellpadding="0" cellspacing="0"><thead><tr class="XbcTableColumns"><th class="XbcAchCol1"><span class="XbcDisplayNone">Achievements </span></th><th class="XbcAchCol2"><span class="XbcDisplayNone">Gamerscore </span></th></tr></thead>'
+#
+# doFileStats (file, engine, mapped, stats) - parses file with doFile, and
+#    returns (gameData, achList, report).  If stats is True (defaults to
+#    whether g_stats is on) report is the RunStats report of parsing just
+#    this file, for RunStats.addFile; otherwise it's None
+#
+def doFileStats (file, engine=None, mapped=None, stats=None):
+    global g_stats
+    if stats is None:
+        stats = g_stats is not None
+    if not stats:
+        return doFile (file, engine, mapped) + (None,)
+
+    parent = g_stats
+    g_stats = RunStats()
+    try:
+        (gameData, achList) = doFile (file, engine, mapped)
+        statCount ("filesParsed")
+        statCount ("bytesRead", os.path.getsize (file))
+        statCount ("achievements", len (achList))
+        return (gameData, achList, g_stats.report())
+    finally:
+        g_stats = parent
 
-    html = getHTML(file)
-    achList = []
-    gameData = {}
+#
+# parseFileCompact ((file, engine, mapped, stats)) - process pool worker for
+#    parseFiles.  Parses file with doFileStats and sends back the
+#    achievements as plain tuples (see packAchList) rather than objects,
+#    which keeps what has to be pickled back to the parent process small
+#
+def parseFileCompact (args):
+    (file, engine, mapped, stats) = args
+    (gameData, achList, report) = doFileStats (file, engine, mapped, stats)
+    return (file, gameData, packAchList (achList), report)
 
-    # read general game data
-    match = re.search (titleRegex, html)
-    if match : 
-        gameData["title"] = stripExtraASCII (match.group('title'))
-        gameData["percent"] = match.group ('percent') 
-        gameData["gs"] = match.group ('gs')
-        gameData["gstotal"] = match.group ('gstotal')
-        gameData["achCount"] = match.group ('achCount')
-        gameData["achTotal"] = match.group ('achTotal')
-        gameData["key"] = genKeyFromGameTitle(match.group('title'))
-        
-        tcount = 999    # for in case there are achs with same date/time
-        for (img, name, desc, gs, month, day, year, hour, min) in re.findall (achRegex, html):
-            tcount = tcount - 1
-
-            ach = {'name' : replaceHTML (name), 
-                'img' : img,
-                'desc' : replaceHTML (desc),
-                'gs' : gs,
-                'tcount' : tcount, 
-                'month' : padZero(str(int(month) + 1)),
-                'day' : padZero(day),
-                'year' : year,
-                'hour' : padZero(hour),
-                'min' : padZero(min)
-            }
-            ach['date'] = ach["year"] + " " + ach["month"] + \
-                " " + ach["day"] + " " + ach["hour"] + \
-                ":" + ach["min"] + ":00"
-
-            achList.append (ach)
-            
-    return (gameData, achList)
+#
+# parseFiles (files, workers, chunksize, pool) - generator that parses each
+#    of files with doFile, yielding (file, gameData, achList) in the same
+#    order as files.  With more than one worker (defaults to g_workers) the
+#    files are spread across a process pool, chunksize files at a time;
+#    inputs smaller than PARALLEL_MINFILES are always parsed serially since
+#    starting the pool would cost more than it saves.  If pool (a
+#    multiprocessing.Pool) is given the files are parsed on it instead, and
+#    it is left running for the caller to close
+#
+def parseFiles (files, workers=None, chunksize=None, pool=None):
+    workers = workers or g_workers
+    if pool is None and (workers <= 1 or len (files) < PARALLEL_MINFILES):
+        for file in files:
+            (gameData, achList, report) = doFileStats (file)
+            if report:
+                g_stats.addFile (file, report)
+            yield (file, gameData, achList)
+        return
+
+    if not chunksize:
+        chunksize = g_chunksize or max (1, len (files) // (workers * 4))
+
+    shared = pool is not None
+    if not shared:
+        pool = multiprocessing.Pool (workers)
+    try:
+        jobs = [(file, g_engine, g_mmap, g_stats is not None) for file in files]
+        for (file, gameData, packed, report) in pool.imap (parseFileCompact, jobs, chunksize):
+            if report:
+                g_stats.addFile (file, report)
+            yield (file, gameData, unpackAchList (packed))
+    except Exception:
+        if not shared:
+            pool.terminate()
+        raise
+    finally:
+        if not shared:
+            pool.close()
+            pool.join()
 
 #
-# readGameData () - looks in the current directory for HTML files (files with
-#    an .html extension), and parses out all game data from them.  Returns
-#    a hash mapping game titles to hashes which contain:
+# packAchList (achList) / unpackAchList (packed) - converts a list of
+#    Achievements to and from a list of plain tuples (see
+#    Achievement.fields), which is much cheaper to pickle
 #
-#    gameInfo => a hash containing information about a game
-#    achList => a list of achievements for the game
+def packAchList (achList):
+    return [ach.fields() for ach in achList]
+
+def unpackAchList (packed):
+    return [Achievement (*fields) for fields in packed]
+
 #
-def readGameData ():
-    games = {}
-    for file in glob.glob ('*.html'):
-        printIndent ('readGameData: processing ' + file + '...')
+# replaceFile (tmpName, filename) - moves the freshly written file tmpName
+#    over filename.  On Windows, where a rename fails if the target exists,
+#    filename is removed first
+#
+def replaceFile (tmpName, filename):
+    if os.name == 'nt' and os.path.exists (filename):
+        os.remove (filename)
+    os.rename (tmpName, filename)
 
-        (gameData, achList) = doFile(file)
-        if gameData:
-            games[gameData["key"]] = {"gameInfo" : gameData, "achList" : achList}
+#
+# fileDigest (filename) - returns the MD5 hex digest of the contents of filename
+#
+def fileDigest (filename):
+    f = open (filename, 'rb')
+    try:
+        return hashlib.md5 (f.read()).hexdigest()
+    finally:
+        f.close()
+
+class ParseCache (object):
+    '''
+    On-disk cache of doFile results, so readGameData only has to parse pages
+    that are new or have changed since the last run.
+
+    Entries are keyed by the absolute path of the page and remember the
+    page's size, mtime and MD5 digest.  A page whose size and mtime are
+    unchanged is a hit straight away; if only the mtime changed the digest
+    decides (so touching or re-saving an identical page doesn't force a
+    re-parse).  A page that was only probed for its header (see
+    putHeader) has no digest or achievements, and only peek() uses it.
+    The whole cache is thrown away if it was written by a different
+    PARSERVERSION, and when saved only the maxEntries most recently used
+    entries are kept.
+    '''
+
+    def __init__ (self, filename=CACHEFILE, maxEntries=CACHE_MAXENTRIES):
+        self.filename = filename
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+
+        # path => [size, mtime, digest, lastUsed, gameData, packed achList],
+        # with digest and achList None for header only entries
+        self.entries = {}
+        self.clock = 0
+        self.dirty = False
+        self.load()
+
+    def load (self):
+        ''' reads the cache file, if there is a usable one '''
+        try:
+            f = open (self.filename, 'rb')
+            try:
+                (version, clock, entries) = cPickle.load (f)
+            finally:
+                f.close()
+        except Exception:
+            # missing, unreadable or corrupt: start over with an empty cache
+            return
+
+        if version == PARSERVERSION:
+            self.clock = clock
+            self.entries = entries
+
+    def save (self):
+        ''' writes the cache file (if anything changed), evicting the least recently used entries '''
+        if not self.dirty:
+            return
+
+        if len (self.entries) > self.maxEntries:
+            byAge = sorted (self.entries.iteritems(), key=lambda item: item[1][3])
+            for (path, entry) in byAge[:len (self.entries) - self.maxEntries]:
+                del self.entries[path]
+
+        # write to a temp file first so a crash can't leave a half written cache
+        tmpName = self.filename + '.tmp'
+        f = open (tmpName, 'wb')
+        try:
+            cPickle.dump ((PARSERVERSION, self.clock, self.entries), f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        replaceFile (tmpName, self.filename)
+        self.dirty = False
+
+    def get (self, filename):
+        ''' returns the cached (gameData, achList) for filename, or None if it needs to be parsed '''
+        path = os.path.abspath (filename)
+        entry = self.entries.get (path)
+        st = os.stat (filename)
+
+        if entry and entry[5] is not None and entry[0] == st.st_size and \
+                (entry[1] == st.st_mtime or entry[2] == fileDigest (filename)):
+            self.hits += 1
+            self.clock += 1
+            entry[1] = st.st_mtime
+            entry[3] = self.clock
+            self.dirty = True
+            return (dict (entry[4]), unpackAchList (entry[5]))
+
+        self.misses += 1
+        return None
+
+    def peek (self, filename):
+        '''
+        returns the cached gameData for filename ({} if it isn't an
+        achievement page), or None if it isn't cached with the same size and
+        mtime.  Doesn't count as a hit or a miss, or as a use of the entry
+        '''
+        entry = self.entries.get (os.path.abspath (filename))
+        if entry is None:
+            return None
+        st = os.stat (filename)
+        if entry[0] == st.st_size and entry[1] == st.st_mtime:
+            return dict (entry[4])
+        return None
+
+    def putHeader (self, filename, gameData):
+        ''' stores the gameData probed from filename's header, unless the whole page is cached '''
+        path = os.path.abspath (filename)
+        entry = self.entries.get (path)
+        if entry and entry[5] is not None:
+            return      # get() checks it against the page when it's needed
+        st = os.stat (filename)
+        self.clock += 1
+        self.entries[path] = [st.st_size, st.st_mtime, None, self.clock, dict (gameData), None]
+        self.dirty = True
+
+    def put (self, filename, gameData, achList):
+        ''' stores the result of parsing filename '''
+        st = os.stat (filename)
+        self.clock += 1
+        self.entries[os.path.abspath (filename)] = [st.st_size, st.st_mtime,
+            fileDigest (filename), self.clock, dict (gameData), packAchList (achList)]
+        self.dirty = True
 
-    return games
+#
+# readPages (files, workers, chunksize, cache, export, pool) - parses out the game data
+#    from each of files (see parseFiles for workers, chunksize and pool).  Pages
+#    found in cache (a ParseCache, defaults to one on CACHEFILE if g_cache is
+#    set) are not parsed again, and the rest are added to it.  Each page's
+#    achievements are added to export (an NDJSONExport, if given) as soon as
+#    it has been read.  Returns a hash mapping each file to the (gameData,
+#    achList) doFile returned for it
+#
+def readPages (files, workers=None, chunksize=None, cache=None, export=None, pool=None):
+    if cache is None and g_cache:
+        cache = ParseCache (CACHEFILE, g_cacheSize)
+
+    files = sorted (files)
+    cached = {}
+    if cache:
+        for file in files:
+            result = cache.get (file)
+            if result:
+                cached[file] = result
+
+    # run parseFiles to the end, so that it shuts its pool down cleanly
+    parsed = dict ([(file, (gameData, achList)) for (file, gameData, achList) in
+        parseFiles ([file for file in files if file not in cached], workers, chunksize, pool)])
+
+    pages = {}
+    for file in files:
+        g_log.info ('readGameData: processing %s...', file)
+
+        if file in cached:
+            (gameData, achList) = cached[file]
+        else:
+            (gameData, achList) = parsed[file]
+            if cache:
+                cache.put (file, gameData, achList)
+        pages[file] = (gameData, achList)
+        if export and gameData:
+            export.add (gameData, achList)
+
+    if cache:
+        g_log.info ('readGameData: cache hits: %d, misses: %d', cache.hits, cache.misses)
+        statCount ("filesCached", cache.hits)
+        cache.save()
+
+    return pages
 
 #
-# doCSVFile (games) - takes a reference to a hash containing information about
-#    games, and processes it into the local file "out.csv"
-# 
-def doCSVFile (games):
-    global g_indent
+# mayBeAchievementPage (file) - reads the first PREFILTER_BYTES of file and
+#    returns (False, bytesRead) if it can't be an achievement page: it has a
+#    LISTMARKER before any PAGEMARKER, or it is shorter than that and has
+#    neither.  Otherwise (it has a PAGEMARKER first, or is longer and has no
+#    markers yet) returns (True, bytesRead)
+#
+def mayBeAchievementPage (file):
+    f = open (file, 'rb')
+    try:
+        prefix = f.read (PREFILTER_BYTES)
+    finally:
+        f.close()
+
+    page = prefix.find (PAGEMARKER)
+    title = prefix.find (LISTMARKER)
+    if page >= 0 and (title < 0 or page < title):
+        return (True, len (prefix))
+    if title >= 0:
+        return (False, len (prefix))
+    return (len (prefix) == PREFILTER_BYTES, len (prefix))
 
-    lines = []
-    gameDayTotals = {}
+#
+# filterPages (files) - returns those of files that may be achievement pages
+#    (see mayBeAchievementPage), logging how many were skipped and how many
+#    bytes weren't read because of it
+#
+def filterPages (files):
+    pages = []
+    (skipped, saved) = (0, 0)
+    for file in files:
+        (keep, bytesRead) = mayBeAchievementPage (file)
+        if keep:
+            pages.append (file)
+        else:
+            skipped += 1
+            saved += os.path.getsize (file) - bytesRead
+    if skipped:
+        g_log.info ('readGameData: skipped %d files that aren\'t achievement pages (%d bytes not read)',
+            skipped, saved)
+    statCount ("filesSkipped", skipped)
+    statCount ("bytesSkipped", saved)
+    return pages
 
-    g_indent += 1
+#
+# probeHeader (file) - reads file only as far as its game header (PROBE_BLOCK
+#    bytes at a time), and returns the gameData for it (see makeGameData),
+#    or None if the file has no header.  Only the last block and the
+#    MMAPOVERLAP bytes before it are held, so a page with no header costs no
+#    more memory than one with it near the top (the title has to be within
+#    that much of the header, as it does for parseMapped)
+#
+def probeHeader (file):
+    f = open (file, 'rb')
+    try:
+        html = ''
+        while True:
+            block = f.read (PROBE_BLOCK)
+            if not block:
+                return None
+            # keep enough of the last block that a header split across the
+            # block boundary is seen whole
+            html = html[-MMAPOVERLAP:] + block
+            (match, title) = findHeader (html, 0, len (html))
+            if match:
+                return makeGameData (title, match.group ('percent'),
+                    match.group ('gs'), match.group ('gstotal'),
+                    match.group ('achCount'), match.group ('achTotal'))
+    finally:
+        f.close()
 
-    for (title, gameData) in games.iteritems():
-        printIndent ("CSV: Processing " + title + "...")
-        g_indent += 1
+#
+# probePages (files, cache, pages) - finds the game header of each of files
+#    that isn't in pages yet and adds it there as (gameData, None), or as
+#    ({}, []) if the file isn't an achievement page.  Headers are taken from
+#    cache (a ParseCache) for the files it holds, and the rest are read off
+#    disk, skipping those filterPages rules out, and added to it
+#
+def probePages (files, cache, pages):
+    unknown = []
+    for file in files:
+        if file in pages:
+            continue
+        gameData = cache and cache.peek (file)
+        if gameData:
+            pages[file] = (gameData, None)
+        elif gameData is None or gameData is False:
+            unknown.append (file)
+        else:
+            pages[file] = ({}, [])
+
+    for file in unknown:
+        pages[file] = ({}, [])
+    for file in filterPages (unknown):
+        gameData = probeHeader (file)
+        if gameData:
+            pages[file] = (gameData, None)
+    if cache:
+        for file in unknown:
+            cache.putHeader (file, pages[file][0])
 
-        achList = gameData["achList"]
-        for ach in achList :
-            printIndent ("CSV: processing " + ach["name"])
-            lines.append (ach["date"] + "--" + str(ach["tcount"]) + ";" + \
-                title + ";" + ach["name"] + ";" + \
-                ach["desc"] + ";" + str(ach["gs"]) + "\n")
+#
+# findSnapshots (files, pages) - groups the saved copies ("snapshots") of
+#    each game's page among files by the headers in pages (see probePages).
+#    Returns a hash mapping each game key to a list of (file, gameData),
+#    newest first: the copy with the most achievements unlocked, then the
+#    most gamerscore, then the latest mtime, then the name that sorts last.
+#    Files without a header aren't included
+#
+def findSnapshots (files, pages):
+    snapshots = {}
+    for file in files:
+        gameData = pages[file][0]
+        if gameData:
+            snapshots.setdefault (gameData["key"], []).append ((file, gameData))
 
-            key = "--".join ([ach["year"], ach["month"], ach["day"], title])
+    def age (snapshot):
+        (file, gameData) = snapshot
+        return (int (gameData["achCount"]), int (gameData["gs"]), os.path.getmtime (file), file)
+    for copies in snapshots.itervalues():
+        copies.sort (key=age, reverse=True)
+    return snapshots
 
-            # python dictionaries suck, this is 1 line in Perl
-            if key in gameDayTotals :
-                gameDayTotals[key] += int(ach["gs"])
-            else:
-                gameDayTotals[key] = int(ach["gs"])
+#
+# readGames (files, workers, chunksize, cache, export, pages, pool) - parses
+#    out all game data from the HTML files (see readPages for workers,
+#    chunksize, cache, export and pool).  Returns a hash mapping game keys (from
+#    genKeyFromGameTitle) to hashes which contain:
+#
+#    gameInfo => a hash containing information about a game
+#    achList => a list of achievements for the game
+#
+#    When there are several saved copies of a game's page (see
+#    findSnapshots) only the newest is parsed, and its gameInfo is used.
+#    Achievements are never locked again, so an older copy can only add
+#    anything if its header counts more achievements than the newest gave;
+#    only those copies are parsed, and their achievements are merged in
+#    (keyed on game, name and unlock time, so each is only added once).
+#
+#    pages (a hash, see probePages) keeps what has been learnt about each
+#    file between calls: files already in it are neither probed nor parsed
+#    again, so the caller only has to drop the files that changed
+#
+def readGames (files, workers=None, chunksize=None, cache=None, export=None, pages=None, pool=None):
+    if cache is None and g_cache:
+        cache = ParseCache (CACHEFILE, g_cacheSize)
+    if pages is None:
+        pages = {}
 
-        g_indent -= 1
+    probePages (files, cache, pages)
+    snapshots = findSnapshots (files, pages)
 
-    lines.sort()
+    def parse (files):
+        pages.update (readPages ([file for file in files if pages[file][1] is None],
+            workers, chunksize, cache, export, pool))
 
-    lines.append("\n")
-    lines.append("\n")
+    parse ([copies[0][0] for copies in snapshots.itervalues()])
+    games = {}
+    older = []
+    for (key, copies) in snapshots.iteritems():
+        (gameData, achList) = pages[copies[0][0]]
+        if gameData:
+            games[key] = {"gameInfo" : gameData, "achList" : achList}
+            older.extend ([file for (file, gameData) in copies[1:]
+                if int (gameData["achCount"]) > len (achList)])
+    skipped = sum ([len (copies) - 1 for copies in snapshots.itervalues()]) - len (older)
+    g_log.info ('readGameData: %d games, %d older snapshots skipped, %d to merge',
+        len (games), skipped, len (older))
+    statCount ("snapshotsSkipped", skipped)
+
+    if older:
+        parse (older)
+        seen = set ([(key, ach.name, ach.ts) for (key, gameData) in games.iteritems()
+            for ach in gameData["achList"]])
+        merged = {}
+        for file in sorted (older):
+            (gameData, achList) = pages[file]
+            if not gameData or gameData["key"] not in games:
+                continue
+            key = gameData["key"]
+            for ach in achList:
+                if (key, ach.name, ach.ts) not in seen:
+                    seen.add ((key, ach.name, ach.ts))
+                    # a copy, so the list kept in pages is left as parsed
+                    if key not in merged:
+                        merged[key] = games[key]["achList"] = list (games[key]["achList"])
+                    merged[key].append (ach)
+
+        # back into page order: newest first
+        for achList in merged.itervalues():
+            achList.sort (key=lambda ach: (ach.ts, ach.tcount), reverse=True)
+        statCount ("snapshotsMerged", len (older))
 
-    printIndent ("CSV: Processing daily totals")
-    for k in sorted(gameDayTotals.keys()):
-        lines.append (k + ";" + str(gameDayTotals[k]) + "\n")
+    return games
 
-    printIndent ("CSV: writing CSV file")
-    f = open ('out.csv', 'w')
-    f.writelines(lines)
-    f.close()
-    printIndent ("CSV: completed....")
-    g_indent -= 1
+#
+# readGameData (workers, chunksize, cache, export) - looks in the current
+#    directory for HTML files (files with an .html extension), and reads
+#    the games from them (see readGames)
+#
+def readGameData (workers=None, chunksize=None, cache=None, export=None):
+    return readGames (glob.glob ('*.html'), workers, chunksize, cache, export)
+
+class AchStore (object):
+    '''
+    The history of every game and achievement ever read, kept in a SQLite
+    database so that it outlives the pages it was parsed from.  save()
+    upserts a games hash (as returned by readGameData): a game is keyed on
+    its game key, and an achievement on its game, name and unlock time (as
+    readGames merges on, so two achievements of one game that share a name
+    are both kept), and saving the same pages again changes nothing.  loadGames() gives back the same kind of
+    hash, which doCSVFile and doForums can work from without any parsing.
+    The achievements are indexed on game key and unlock time, unlock time
+    and gamerscore, so achievements() can answer date range and per game
+    questions from an index instead of a table scan.
+    '''
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            key TEXT PRIMARY KEY, title TEXT, percent TEXT, gs TEXT,
+            gstotal TEXT, achCount TEXT, achTotal TEXT);
+        CREATE TABLE IF NOT EXISTS achievements (
+            gameKey TEXT NOT NULL, name TEXT NOT NULL, img TEXT, descr TEXT,
+            gs INTEGER, tcount INTEGER, ts INTEGER,
+            PRIMARY KEY (gameKey, name, ts));
+        CREATE INDEX IF NOT EXISTS achievementsGameTime ON achievements (gameKey, ts);
+        CREATE INDEX IF NOT EXISTS achievementsTime ON achievements (ts);
+        CREATE INDEX IF NOT EXISTS achievementsGS ON achievements (gs);
+    """
+    # the SCHEMA version, kept in the database's user_version; databases
+    # from before it was kept have achievements keyed on game and name only
+    VERSION = 1
+    GAMEFIELDS = ("key", "title", "percent", "gs", "gstotal", "achCount", "achTotal")
+    ACHCOLUMNS = "name, img, descr, gs, tcount, ts"
+
+    def __init__ (self, filename=None):
+        if sqlite3 is None:
+            raise RuntimeError ("AchStore needs the sqlite3 module")
+        self.filename = filename or DBFILE
+        self.db = sqlite3.connect (self.filename)
+        self.db.text_factory = str      # titles etc. are Latin-1 byte strings
+        self.upgrade()
+
+    def upgrade (self):
+        ''' creates the tables, first moving the achievements of an older database into the current ones '''
+        version = self.db.execute ("PRAGMA user_version").fetchone()[0]
+        old = version < self.VERSION and self.db.execute ("SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'achievements'").fetchone()
+        if old:
+            g_log.info ('AchStore: upgrading %s', self.filename)
+            self.db.executescript ("ALTER TABLE achievements RENAME TO achievementsOld;"
+                "DROP INDEX IF EXISTS achievementsGameTime;"
+                "DROP INDEX IF EXISTS achievementsTime;"
+                "DROP INDEX IF EXISTS achievementsGS;")
+        self.db.executescript (self.SCHEMA)
+        if old:
+            self.db.executescript ("INSERT INTO achievements SELECT * FROM achievementsOld;"
+                "DROP TABLE achievementsOld;")
+        self.db.execute ("PRAGMA user_version = %d" % self.VERSION)
+        self.db.commit()
+
+    def close (self):
+        self.db.close()
+
+    def save (self, games):
+        with self.db:
+            for gameData in games.itervalues():
+                gameInfo = gameData["gameInfo"]
+                self.db.execute ("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [gameInfo[field] for field in self.GAMEFIELDS])
+                self.db.executemany ("INSERT OR REPLACE INTO achievements VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(gameInfo["key"],) + ach.fields() for ach in gameData["achList"]])
+
+    def loadGames (self):
+        games = {}
+        for row in self.db.execute ("SELECT * FROM games"):
+            gameInfo = dict (zip (self.GAMEFIELDS, row))
+            games[gameInfo["key"]] = {"gameInfo" : gameInfo, "achList" : []}
+
+        # newest first (highest tcount), as they are on the pages
+        for row in self.db.execute ("SELECT gameKey, " + self.ACHCOLUMNS + \
+                " FROM achievements ORDER BY gameKey, ts DESC, tcount DESC"):
+            games[row[0]]["achList"].append (Achievement (*row[1:]))
+        return games
+
+    def achievements (self, gameKey=None, start=None, end=None, minGS=None):
+        '''
+        returns the (gameKey, Achievement) pairs unlocked at or after start and
+        before end (UTC seconds since the epoch), for the game gameKey and
+        worth at least minGS, oldest first; each limit is optional
+        '''
+        (where, args) = ([], [])
+        for (test, arg) in (("gameKey = ?", gameKey), ("ts >= ?", start),
+                ("ts < ?", end), ("gs >= ?", minGS)):
+            if arg is not None:
+                where.append (test)
+                args.append (arg)
+        sql = "SELECT gameKey, " + self.ACHCOLUMNS + " FROM achievements"
+        if where:
+            sql += " WHERE " + " AND ".join (where)
+        return [(row[0], Achievement (*row[1:])) for row in
+            self.db.execute (sql + " ORDER BY ts, tcount", args)]
+
+#
+# normTitle (title) - returns the key a game's title is stored under in a
+#    TileIndex: the title with its HTML character codes decoded, control
+#    characters (CONTROLCHARS) removed and runs of whitespace made single
+#    spaces.  Unlike genKeyFromGameTitle punctuation and accented letters
+#    are kept, so two titles only share a key if they would display the same
+#
+def normTitle (title):
+    return ' '.join (replaceHTML (title).translate (None, CONTROLCHARS).split())
+
+class TileIndex (object):
+    '''
+    Index of the game tile (icon) URLs listed in games.html, keyed by
+    normTitle.  Offers exact lookups by title (get, lookup), lookups by the
+    old genKeyFromGameTitle keys ([]), and case-insensitive prefix lookups
+    (prefix) with a bisect over the sorted keys.  A key shared by two games
+    with different tiles is ambiguous, and no lookup by it finds either.
+    getGameImgs keeps a built index on disk so games.html only has to be
+    parsed when it changes.
+    '''
+
+    def __init__ (self, tiles=()):
+        self.source = list (tiles)
+        self.tiles = {}
+        self.legacy = {}
+        for (title, url) in self.source:
+            # a key shared by two games with different tiles can't be trusted
+            for (keys, key) in ((self.tiles, normTitle (title)),
+                    (self.legacy, genKeyFromGameTitle (title))):
+                if key in keys and keys[key] != url:
+                    keys[key] = None
+                else:
+                    keys[key] = url
+
+        self.sortedKeys = sorted ([(key.lower(), key) for (key, url) in self.tiles.iteritems()
+            if url is not None])
+
+    def __len__ (self):
+        return len (self.sortedKeys)
+
+    def __getitem__ (self, legacyKey):
+        ''' returns the tile for a genKeyFromGameTitle key, raising KeyError if there isn't exactly one '''
+        url = self.legacy[legacyKey]
+        if url is None:
+            raise KeyError (legacyKey)
+        return url
+
+    def get (self, title, default=None):
+        ''' returns the tile for the game title, or default (also if the title is ambiguous) '''
+        url = self.tiles.get (normTitle (title))
+        if url is None:
+            return default
+        return url
+
+    def prefix (self, prefix):
+        ''' returns a sorted list of (title key, tile) for every game whose title starts with prefix (ignoring case) '''
+        prefix = normTitle (prefix).lower()
+        i = bisect.bisect_left (self.sortedKeys, (prefix,))
+        matches = []
+        while i < len (self.sortedKeys) and self.sortedKeys[i][0].startswith (prefix):
+            key = self.sortedKeys[i][1]
+            matches.append ((key, self.tiles[key]))
+            i += 1
+        return matches
+
+    def lookup (self, gameInfo, default=""):
+        '''
+        returns the tile for the game whose info hash (from doFile) is
+        gameInfo: by title, or failing that by its key if that's unambiguous,
+        or default if the game isn't in the index
+        '''
+        url = self.get (gameInfo["title"])
+        if url is None:
+            url = self.legacy.get (gameInfo["key"])
+        if url is None:
+            return default
+        return url
+
+    @staticmethod
+    def parse (html):
+        ''' builds a TileIndex from the contents of a games.html page '''
+        return TileIndex ([(title, url) for (url, title) in GAMEDATAREGEX.findall (html)])
+
+#
+# getGameImgs (filename, indexFile) - returns a TileIndex of the game tiles
+#    in the games page filename (defaults to GAMESFILE).  The index is saved
+#    to indexFile (defaults to TILEINDEXFILE) along with the page's size,
+#    mtime and digest, and is rebuilt from there rather than from the page
+#    for as long as the page is unchanged.  If the page is missing the index is empty.
+#
+def getGameImgs (filename=None, indexFile=None):
+    filename = filename or GAMESFILE
+    indexFile = indexFile or TILEINDEXFILE
+
+    try:
+        st = os.stat (filename)
+    except OSError:
+        g_log.warning ('getGameImgs: %s not found, no game tiles', filename)
+        return TileIndex()
+
+    saved = None
+    try:
+        f = open (indexFile, 'rb')
+        try:
+            saved = cPickle.load (f)
+        finally:
+            f.close()
+    except Exception:
+        pass
+
+    if saved and saved[0] == (TILEINDEXVERSION, os.path.abspath (filename), st.st_size) and \
+            (saved[1] == st.st_mtime or saved[2] == fileDigest (filename)):
+        return TileIndex (saved[3])
+
+    digest = fileDigest (filename)
+    g_log.info ('getGameImgs: indexing %s...', filename)
+    index = TileIndex.parse (getHTML (filename))
+
+    tmpName = indexFile + '.tmp'
+    f = open (tmpName, 'wb')
+    try:
+        cPickle.dump (((TILEINDEXVERSION, os.path.abspath (filename), st.st_size),
+            st.st_mtime, digest, index.source), f, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    replaceFile (tmpName, indexFile)
+    return index
     
+class AchColumns (object):
+    '''
+    Column store of achievements for working out grouped gamerscore totals
+    (see aggregate).  Each achievement is a row of three int arrays: the
+    game (an index into titles), the UTC unlock day (as yyyymmdd) and the
+    gamerscore.  Week, month and year columns are worked out from the day.
+    '''
+
+    # the columns aggregate can group by
+    GROUPS = ('day', 'week', 'month', 'year', 'game')
+
+    def __init__ (self, games=None):
+        self.titles = []
+        self.titleIndex = {}
+        self.game = array.array ('i')
+        self.day = array.array ('i')
+        self.gs = array.array ('i')
+        self.dayKeys = {}
+
+        if games:
+            for (title, gameData) in games.iteritems():
+                for ach in gameData["achList"]:
+                    self.add (title, ach)
+
+    def __len__ (self):
+        return len (self.gs)
+
+    def add (self, title, ach):
+        ''' adds a row for the Achievement ach from the game title '''
+        game = self.titleIndex.get (title)
+        if game is None:
+            game = self.titleIndex[title] = len (self.titles)
+            self.titles.append (title)
+
+        # yyyymmdd for each UTC day seen, so gmtime is only called once a day
+        utcDay = ach.ts // 86400
+        day = self.dayKeys.get (utcDay)
+        if day is None:
+            t = time.gmtime (ach.ts)
+            day = self.dayKeys[utcDay] = t.tm_year * 10000 + t.tm_mon * 100 + t.tm_mday
+
+        self.game.append (game)
+        self.day.append (day)
+        self.gs.append (ach.gs)
+
+    @staticmethod
+    def weekOf (day):
+        ''' returns the ISO year and week of the yyyymmdd int day, as yyyyww '''
+        (year, week, weekday) = datetime.date (day // 10000, day // 100 % 100, day % 100).isocalendar()
+        return year * 100 + week
+
+    def column (self, name):
+        ''' returns the group column name (one of GROUPS) as a sequence of ints '''
+        if name == 'day':
+            return self.day
+        if name == 'game':
+            return self.game
+        if name == 'month':
+            return array.array ('i', [day // 100 for day in self.day])
+        if name == 'year':
+            return array.array ('i', [day // 10000 for day in self.day])
+        if name == 'week':
+            # there are far fewer days than rows
+            weeks = dict ([(day, self.weekOf (day)) for day in set (self.day)])
+            return array.array ('i', [weeks[day] for day in self.day])
+        raise ValueError ("can't group achievements by " + repr (name))
+
+    def vectorColumn (self, name):
+        ''' column, as a NumPy array (the stored columns are used in place rather than copied) '''
+        if name == 'game':
+            return numpy.frombuffer (self.game, dtype=numpy.intc)
+
+        day = numpy.frombuffer (self.day, dtype=numpy.intc)
+        if name == 'day':
+            return day
+        if name == 'month':
+            return day // 100
+        if name == 'year':
+            return day // 10000
+        if name == 'week':
+            (days, rows) = numpy.unique (day, return_inverse=True)
+            return numpy.array ([self.weekOf (d) for d in days.tolist()], dtype=numpy.intc)[rows]
+        raise ValueError ("can't group achievements by " + repr (name))
+
+    def aggregate (self, by=('day', 'game'), vectorized=None):
+        '''
+        Returns a hash mapping each group to a (total gamerscore, achievement
+        count) pair, where by names the columns to group by (see GROUPS) and
+        a group is a tuple of the values of those columns: ints for the date
+        columns, and titles for game.  The sums are done with NumPy when it
+        is available (or if vectorized says to), and in plain Python if not.
+        '''
+        if isinstance (by, basestring):
+            by = (by,)
+
+        if vectorized is None:
+            vectorized = numpy is not None
+        if vectorized and len (self):
+            totals = self.sumVectorized ([self.vectorColumn (name) for name in by])
+        else:
+            totals = self.sumPython ([self.column (name) for name in by])
+
+        if 'game' not in by:
+            return totals
+
+        # swap game indexes for titles
+        gameCol = list (by).index ('game')
+        result = {}
+        for (key, value) in totals.iteritems():
+            key = list (key)
+            key[gameCol] = self.titles[key[gameCol]]
+            result[tuple (key)] = value
+        return result
+
+    def sumPython (self, cols):
+        ''' aggregate's pure Python fallback: one dict update per row '''
+        totals = {}
+        keys = cols and itertools.izip (*cols) or itertools.repeat ((), len (self))
+        for (key, gs) in itertools.izip (keys, self.gs):
+            total = totals.get (key)
+            if total:
+                total[0] += gs
+                total[1] += 1
+            else:
+                totals[key] = [gs, 1]
+        return dict ([(key, tuple (total)) for (key, total) in totals.iteritems()])
+
+    def sumVectorized (self, cols):
+        ''' aggregate's NumPy version: packs the group columns into one key and reduces with bincount '''
+        combined = numpy.zeros (len (self), dtype=numpy.int64)
+        values = []
+        for col in cols:
+            (colValues, codes) = numpy.unique (col, return_inverse=True)
+            combined = combined * len (colValues) + codes
+            values.append (colValues)
+
+        (keys, groups) = numpy.unique (combined, return_inverse=True)
+        sums = numpy.bincount (groups, weights=numpy.frombuffer (self.gs, dtype=numpy.intc))
+        counts = numpy.bincount (groups)
+
+        totals = {}
+        for (i, key) in enumerate (keys.tolist()):
+            group = []
+            for colValues in reversed (values):
+                (key, code) = divmod (key, len (colValues))
+                group.insert (0, int (colValues[code]))
+            totals[tuple (group)] = (int (round (sums[i])), int (counts[i]))
+        return totals
+
+#
+# doCSVFile (games, memBudget, filename) - takes a reference to a hash containing information about
+#    games, and processes it into the local file filename (defaults to CSVFILE).  The lines for
+#    each game are sorted on their own and then merged (with a heap) as they
+#    are written out, so the file is the same as sorting every line at once.
+#    Once more than memBudget bytes (defaults to g_csvBudget) of sorted lines
+#    are being held in memory they are merged and spilled to a temporary file
+# 
+@logIndented
+def doCSVFile (games, memBudget=None, filename=None):
+    if memBudget is None:
+        memBudget = g_csvBudget
+
+    runs = []       # sorted runs already spilled to temporary files
+    pending = []    # sorted runs still in memory
+    pendingBytes = 0
+    columns = AchColumns()
+    debug = g_log.isEnabledFor (logging.DEBUG)
+
+    try:
+        for (title, gameData) in games.iteritems():
+            g_log.info ("CSV: Processing %s...", title)
+
+            lines = []
+            achList = gameData["achList"]
+            with g_logIndent:
+                for ach in achList :
+                    if debug:
+                        g_log.debug ("CSV: processing %s", ach.name)
+                    line = utcDate (ach.ts) + "--" + str(ach.tcount) + ";" + \
+                        title + ";" + ach.name + ";" + \
+                        ach.desc + ";" + str(ach.gs) + "\n"
+                    lines.append (line)
+                    pendingBytes += len (line)
+                    columns.add (title, ach)
+
+            with statStage ("sort"):
+                lines.sort()
+            pending.append (lines)
+
+            if pendingBytes > memBudget:
+                g_log.info ("CSV: spilling %d bytes to a temporary file", pendingBytes)
+                statCount ("bytesSpilled", pendingBytes)
+                run = tempfile.TemporaryFile()
+                with statStage ("spill"):
+                    run.writelines (heapq.merge (*pending))
+                run.seek (0)
+                runs.append (run)
+                pending = []
+                pendingBytes = 0
+
+        g_log.info ("CSV: writing CSV file")
+        f = open (filename or CSVFILE, 'w')
+        try:
+            # temp files iterate line by line, so they merge just like the lists
+            with statStage ("merge"):
+                f.writelines (heapq.merge (*(runs + pending)))
+
+            f.write ("\n")
+            f.write ("\n")
+
+            g_log.info ("CSV: Processing daily totals")
+            with statStage ("dailyTotals"):
+                dayTotals = columns.aggregate (('day', 'game'))
+                for (day, title) in sorted (dayTotals.keys()):
+                    f.write ("%04d--%02d--%02d--%s;%d\n" % (day // 10000, day // 100 % 100,
+                        day % 100, title, dayTotals[(day, title)][0]))
+            statCount ("bytesWritten", f.tell())
+        finally:
+            f.close()
+    finally:
+        for run in runs:
+            run.close()
+
+    g_log.info ("CSV: completed....")
+    
+class NDJSONExport (object):
+    '''
+    Append-only export of every achievement read, as one JSON object per
+    line in filename (defaults to NDJSONFILE), so the game, name and
+    description can't be confused by the characters in them the way they
+    can in out.csv, and tools downstream only have to read what's new.
+    Each record is keyed on its game key, name and unlock time (the same as
+    readGameData merges on), and a short digest of each key written is kept
+    in indexFile (defaults to NDJSONINDEXFILE), so that later runs only
+    append records that haven't been written before.  Records are flushed
+    before their keys are, so if a run is interrupted the next one may
+    repeat a few records, but never loses any.
+    '''
+    def __init__ (self, filename=None, indexFile=None):
+        self.filename = filename or NDJSONFILE
+        self.indexFile = indexFile or NDJSONINDEXFILE
+        self.keys = set()
+        self.appended = 0
+        try:
+            f = open (self.indexFile)
+            try:
+                self.keys.update ([line.rstrip ('\n') for line in f])
+            finally:
+                f.close()
+        except IOError:
+            pass
+        self.out = open (self.filename, 'ab')
+        self.index = open (self.indexFile, 'ab')
+
+    def add (self, gameData, achList):
+        records = []
+        keys = []
+        # the title comes off the page still HTML encoded; name and desc don't
+        title = replaceHTML (gameData["title"])
+        for ach in achList:
+            key = hashlib.sha1 ('\0'.join ((gameData["key"], ach.name, str (ach.ts)))).hexdigest()[:16]
+            if key in self.keys:
+                continue
+            self.keys.add (key)
+            keys.append (key + '\n')
+            # the strings are Latin-1 bytes; JSON gets them \u escaped
+            records.append (json.dumps ({"gameKey" : gameData["key"],
+                "game" : title, "name" : ach.name, "desc" : ach.desc,
+                "img" : ach.img, "gs" : ach.gs, "ts" : ach.ts,
+                "unlocked" : time.strftime ("%Y-%m-%dT%H:%M:%SZ", time.gmtime (ach.ts))},
+                encoding='latin-1', sort_keys=True) + '\n')
+
+        if records:
+            self.out.write (''.join (records))
+            self.out.flush()
+            self.index.write (''.join (keys))
+            self.index.flush()
+            self.appended += len (records)
+            statCount ("recordsExported", len (records))
+
+    def close (self):
+        g_log.info ("NDJSON: appended %d records to %s", self.appended, self.filename)
+        self.out.close()
+        self.index.close()
+
 
 #
 # headerInfo (title, percent, gamerscore, gamerscoreTotal, achievementCount, achievementTotal
 #    gameIconURL) - formats the supplied parameters into a single pretty string using BBC
-#    forum markup. 
+#    forum markup.  The icon is left out if gameIconURL is empty
 #
 def headerInfo (title, percent, gs, gstotal, ach, achtotal, gameIcon) : 
 
@@ -312,86 +1995,178 @@ def headerInfo (title, percent, gs, gstotal, ach, achtotal, gameIcon) :
     if gstotal == 0:
         gstotal = 1
 
-    return '[CENTER][IMG]' + gameIcon + '[/IMG]\n[SIZE="3"][b]' + \
-        title + '[/b][/SIZE]\n' + ach + ' / ' + achtotal + ' (' + \
-        percent + '%) achievements for ' + gs + ' / ' + gstotal + \
-        '[IMG]' + GICONURL + '[/IMG] (' + \
-        str(round(float(gs) / float(gstotal) * 100.0, 1)) + '%)[/CENTER]' 
+    if gameIcon:
+        gameIcon = '[IMG]' + gameIcon + '[/IMG]\n'
+
+    return FORUMHEADER % (gameIcon, title, ach, achtotal, percent, gs, gstotal,
+        round(float(gs) / float(gstotal) * 100.0, 1))
 
 #
-# formatDate (day, month, year, hour, min) - formats the supplied date/time
-#    value into a string in the format:
+# formatDate (day, month, year, hour, min) - formats the supplied UTC date/time
+#    value into a string (in local time, unless g_utc is set) in the format:
 #
 #    MMMM DD, YYYY at H:MM AMPM
 #
+#    doForums uses a LocalTime directly, which is much faster for many times
+#
 def formatDate (day, month, year, hour, min):
-    return datetime.datetime(int(year), int(month), int(day), int(hour), \
-        int(min)).strftime("%B %d, %Y at %I:%M%p")
+    ts = calendar.timegm ((int (year), int (month), int (day), int (hour), int (min), 0))
+    return LocalTime (ts, ts, g_utc).format (ts)
+
+class AchIndex (object):
+    '''
+    The achievements of a single game sorted by unlock time (ties broken by
+    tcount), so that the achievements from the most recent day, or those
+    unlocked after a given time, can be found with a bisect instead of a
+    sort and a scan over the whole list.
+    '''
+
+    def __init__ (self, achList):
+        self.achs = sorted (achList, key=lambda ach: (ach.ts, ach.tcount))
+        self.times = [ach.ts for ach in self.achs]
+
+    def __len__ (self):
+        return len (self.achs)
+
+    def latest (self):
+        ''' returns the unlock time of the most recent achievement (None if there are none) '''
+        if self.times:
+            return self.times[-1]
+        return None
+
+    def latestDay (self, clock=None):
+        '''
+        returns the achievements unlocked on the same day as the most recent
+        one, oldest first.  Days are in local time as given by the LocalTime
+        clock (UTC days if there isn't one)
+        '''
+        if not self.times:
+            return []
+        offset = clock and clock.offset (self.times[-1]) or 0
+        dayStart = self.times[-1] - (self.times[-1] + offset) % 86400
+        return self.achs[bisect.bisect_left (self.times, dayStart):]
+
+    def since (self, ts):
+        ''' returns the achievements unlocked after the time ts, oldest first '''
+        return self.achs[bisect.bisect_right (self.times, ts):]
 
-def doForums (games, gameImages, gs):
-    global g_indent
-    g_indent += 1
+#
+# getAchIndex (gameData) - returns the AchIndex for the achList of one game
+#    in the hash returned by readGameData, building it the first time
+#
+def getAchIndex (gameData):
+    index = gameData.get ("index")
+    if index is None or len (index) != len (gameData["achList"]):
+        index = gameData["index"] = AchIndex (gameData["achList"])
+    return index
 
-    postIncrease = 0
-    gameCount = len (games)
+#
+# loadPosted (filename) / savePosted (filename, posted) - reads and writes the
+#    hash of game keys to the unlock time of the last achievement posted for
+#    that game, used by doForums in incremental mode
+#
+def loadPosted (filename=POSTEDFILE):
+    try:
+        f = open (filename, 'r')
+        try:
+            return json.load (f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}
+
+def savePosted (posted, filename=POSTEDFILE):
+    f = open (filename, 'w')
+    try:
+        json.dump (posted, f)
+    finally:
+        f.close()
 
-    f = open ('out.txt', 'w')
-    
+#
+# doForums (games, gameImages, gs, incremental, filename, postedFile) - writes
+#    a forum post (in BBCode) to filename (defaults to FORUMFILE) with, for each game,
+#    the achievements unlocked on the most recent day any of its
+#    achievements were.  In incremental mode
+#    (defaults to g_incremental) it instead has every achievement unlocked
+#    since the last one posted for that game (as recorded in postedFile,
+#    which defaults to POSTEDFILE),
+#    and games with nothing new are left out
+#
+@logIndented
+def doForums (games, gameImages, gs, incremental=None, filename=None, postedFile=None):
+    if incremental is None:
+        incremental = g_incremental
+    postedFile = postedFile or POSTEDFILE
+    posted = incremental and loadPosted (postedFile) or {}
+
+    # the range of unlock times that may be posted, for the local time table
+    indexes = [getAchIndex (gameData) for gameData in games.itervalues()]
+    times = [index.times[i] for index in indexes for i in (0, -1) if index.times]
+    clock = LocalTime (min (times or [0]), max (times or [-1]), g_utc)
+
+    # pick out what to post for each game: the most recent day's achievements
+    # (newest first, as on the xbox.com pages), or everything since last time
+    toPost = []
     for (title, gameData) in games.iteritems():
-        printIndent ("ForumPost: Processing " + title + "...");
-        achList = gameData["achList"]
+        index = getAchIndex (gameData)
+        key = gameData["gameInfo"]["key"]
+        if key in posted:
+            achs = index.since (posted[key])
+            if not achs:
+                continue
+        else:
+            achs = index.latestDay (clock)
+        if incremental:
+            posted[key] = index.latest()
+
+        achs.reverse()
+        toPost.append ((title, gameData, achs))
+
+    postIncrease = 0
+    gameCount = len (toPost)
+    debug = g_log.isEnabledFor (logging.DEBUG)
+
+    f = open (filename or FORUMFILE, 'w')
+
+    # each game's part of the post is rendered from the templates into a
+    # list, and written with a single join and write
+    achTemplate = FORUMACH
+    formatTime = clock.format
+    for (title, gameData, todaysAchs) in toPost:
+        g_log.info ("ForumPost: Processing %s...", title)
         gameInfo = gameData["gameInfo"]
-        gameTile = gameImages[gameData["gameInfo"]["key"]]
+        gameTile = gameImages.lookup (gameInfo)
     
-        f.write (headerInfo (gameInfo["title"], gameInfo["percent"], \
+        parts = [headerInfo (gameInfo["title"], gameInfo["percent"], \
             gameInfo["gs"], gameInfo["gstotal"], \
             gameInfo["achCount"], gameInfo["achTotal"], \
-            gameTile))
-
-        f.write ('\n\n')
-        printIndent ("ForumPost: sorting achievements...");
-
-        # now we want a list of all achieements earned on the most recent
-        # day an achievement was earned, and sorted by tcount.  So we sort
-        # the achs by tcount, get the most recent ach, and filter out achs
-        # that do not occur on the same day
- 
-        achList.sort (key=lambda x: x["tcount"], reverse=True)
-        mostRecentAch = achList[0]
-        todaysAchs = filter (lambda x: x["month"] == mostRecentAch["month"] and \
-            x["day"] == mostRecentAch["day"] and \
-            x["year"] == mostRecentAch["year"], achList)
-
-        g_indent += 1
+            gameTile), '\n\n']
 
         total = 0
-        for ach in todaysAchs:
-            printIndent ("ForumPost: processing " + ach["name"])
-            f.write('[IMG]' + ach["img"] + '[/IMG]\n[b]' + \
-                ach["name"] + '[/b] - ' + ach["desc"] + \
-                ' (' + str(ach["gs"]) + ' [IMG]' + \
-                GICONURL + '[/IMG]) (Acquired ' + \
-                formatDate (ach["day"], ach["month"], ach["year"], ach["hour"], ach["min"]) + \
-                ')\n\n')
-            total += int(ach["gs"])
+        with g_logIndent:
+            for ach in todaysAchs:
+                if debug:
+                    g_log.debug ("ForumPost: processing %s", ach.name)
+                parts.append (achTemplate % (ach.img, ach.name, ach.desc, ach.gs,
+                    formatTime (ach.ts)))
+                total += ach.gs
         
         if gameCount > 1:
-            f.write('[SIZE="2"][CENTER]Total GS for day in ' + \
-                gameInfo["title"] + ': ' + str(total) + ' [IMG]' + \
-                GICONURL + '[/IMG][/CENTER][/SIZE]\n\n')
+            parts.append (FORUMGAMETOTAL % (gameInfo["title"], total))
 
-        f.write ('[CENTER]------------------------------------[/CENTER]\n\n')
+        parts.append (FORUMSEPARATOR)
+        f.write (''.join (parts))
 
-        g_indent -= 1
         postIncrease = postIncrease + total
 
-    f.write ('[SIZE="3"][CENTER]Total increase in GS in this update: ' + \
-        str(postIncrease) + ' [IMG]' + GICONURL + '[/IMG]\nNew Total GS: ' + \
-        commify(str(gs)) + ' [IMG]' +  GICONURL + '[/IMG][/CENTER][/SIZE]\n\n')
+    f.write (FORUMFOOTER % (postIncrease, commify(str(gs))))
 
+    statCount ("bytesWritten", f.tell())
+    statCount ("achievementsPosted", sum ([len (achs) for (title, gameData, achs) in toPost]))
     f.close()
-    printIndent ("ForumPost: completed...."); 
-    g_indent -= 1
+    if incremental:
+        savePosted (posted, postedFile)
+    g_log.info ("ForumPost: completed....")
     return "42"
 
 #
@@ -401,32 +2176,796 @@ def spacesToPlus (s):
     return "+".join (s.split(' '))
 
 
+#
+# fetchRequest (connections, url, timeout, proxies) - makes one GET request
+#    for url over the keep-alive connections (a hash of the open connections,
+#    see fetchWorker), going through the proxy for its scheme in proxies (as
+#    urllib.getproxies returns them) unless the host bypasses it.  Returns
+#    (status, body, location) - location being the Location header or None -
+#    or None if the request failed.  A request that fails on a reused
+#    connection is retried once on a fresh one, in case the server had
+#    closed it; one that fails on a fresh connection or times out isn't
+#
+def fetchRequest (connections, url, timeout, proxies):
+    parts = urlparse.urlsplit (url)
+    path = parts.path or '/'
+    if parts.query:
+        path = path + '?' + parts.query
+    host = parts.netloc
+    tunnel = None
+
+    proxy = proxies.get (parts.scheme)
+    if proxy and not urllib.proxy_bypass (parts.hostname or ''):
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        host = urlparse.urlsplit (proxy).netloc
+        if parts.scheme == 'https':
+            tunnel = parts.netloc
+        else:
+            path = urlparse.urlunsplit (parts[:4] + ('',))
+
+    key = (parts.scheme, host, tunnel)
+    for attempt in (1, 2):
+        conn = connections.get (key)
+        reused = conn is not None
+        if not reused:
+            connClass = parts.scheme == 'https' and httplib.HTTPSConnection or httplib.HTTPConnection
+            conn = connections[key] = connClass (host, timeout=timeout)
+            if tunnel:
+                conn.set_tunnel (parts.hostname, parts.port)
+        try:
+            conn.request ('GET', path)
+            response = conn.getresponse()
+            result = (response.status, response.read(), response.getheader ('location'))
+            if response.will_close:
+                conn.close()
+                del connections[key]
+            return result
+        except (httplib.HTTPException, socket.error), e:
+            conn.close()
+            del connections[key]
+            if not reused or isinstance (e, socket.timeout):
+                return None
+    return None
+
+#
+# fetchWorker (jobs, results, timeout, proxies) - thread body for fetchAll.
+#    Takes URLs off the jobs queue until it is empty and stores (status,
+#    body) for each in results, or None if it couldn't be fetched.  Each
+#    worker keeps one keep-alive connection per host open for as long as the
+#    server allows (see fetchRequest), and follows up to FETCH_MAXREDIRECTS
+#    redirects; a URL that redirects more often than that is stored with
+#    the last redirect's status
+#
+def fetchWorker (jobs, results, timeout, proxies):
+    connections = {}
+    try:
+        while True:
+            try:
+                url = jobs.get_nowait()
+            except Queue.Empty:
+                return
+
+            target = url
+            for hop in range (FETCH_MAXREDIRECTS + 1):
+                result = fetchRequest (connections, target, timeout, proxies)
+                if result is None or result[0] not in FETCH_REDIRECTS or not result[2]:
+                    break
+                target = urlparse.urljoin (target, result[2])
+                if urlparse.urlsplit (target).scheme not in ('http', 'https'):
+                    break
+            results[url] = result and result[:2]
+    finally:
+        for conn in connections.itervalues():
+            conn.close()
+
+#
+# fetchAll (urls, workers, timeout) - fetches all of urls with up to workers
+#    (defaults to FETCH_WORKERS) concurrent requests, giving up on any one
+#    request after timeout seconds (defaults to FETCH_TIMEOUT), and going
+#    through the proxies set in the environment (http_proxy, no_proxy...).
+#    Returns a hash mapping each URL to a (status, body) pair, or to None if
+#    the URL couldn't be fetched
+#
+def fetchAll (urls, workers=None, timeout=None):
+    jobs = Queue.Queue()
+    for url in set (urls):
+        jobs.put (url)
+
+    results = {}
+    proxies = urllib.getproxies()
+    threads = [threading.Thread (target=fetchWorker, args=(jobs, results, timeout or FETCH_TIMEOUT, proxies))
+        for dummy in range (min (workers or FETCH_WORKERS, jobs.qsize()))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+#
+# getGamerScores (gamertags, workers, timeout, cardURL) - returns a hash
+#    mapping each of the supplied gamertags to its current gamerscore, or to
+#    "-1" if the gamerscore could not be determined.  The gamercards are
+#    fetched concurrently (see fetchAll); cardURL (defaults to GAMERCARDURL)
+#    is where from, with %s standing for the gamertag
+#
+def getGamerScores (gamers, workers=None, timeout=None, cardURL=None):
+    cardURL = cardURL or GAMERCARDURL
+    urls = dict ([(gamer, cardURL % spacesToPlus (gamer)) for gamer in gamers])
+    pages = fetchAll (urls.values(), workers, timeout)
+
+    scores = {}
+    for gamer in gamers:
+        page = pages.get (urls[gamer])
+        m = page and page[0] == httplib.OK and GSREGEX.search (page[1])
+        if m :
+            scores[gamer] = m.group('gs')
+        else:
+            scores[gamer] = "-1"
+    return scores
+
 #
 # getGamerScore (gamertag) - returns the current gamerscore for
 #    the supplied gamertag, or "-1" if the gamerscore could not
 #    be determined
 #
 def getGamerScore (gamer):
-    f = urllib.urlopen ("http://gamercard.xbox.com/" + spacesToPlus(gamer) + ".card")
-    html = f.read()
-    f.close()
+    return getGamerScores ([gamer])[gamer]
+
+#
+# collectImageURLs (games, gameImages) - returns the URLs of every achievement
+#    image in games and every game's tile in gameImages (a TileIndex, see
+#    getGameImgs), each once, sorted
+#
+def collectImageURLs (games, gameImages):
+    urls = set()
+    for gameData in games.itervalues():
+        urls.update ([ach.img for ach in gameData["achList"]])
+        urls.add (gameImages.lookup (gameData["gameInfo"]))
+    urls.discard ("")
+    return sorted (urls)
+
+class ImageCache (object):
+    '''
+    Local mirror of the images the forum post links to.  Each image is saved
+    once, under the SHA-1 of its contents (plus the URL's extension), in
+    directory, and IMAGEINDEXFILE maps each URL fetched to that file name.
+    URLs already in the index aren't fetched again, and an image that turns
+    up under several URLs (across games, or saved copies of a page) is only
+    stored once.  prefetch() fetches with fetchAll, IMAGE_BATCH URLs at a
+    time, saving the index after each batch so an interrupted run keeps
+    what it got.
+    '''
+    def __init__ (self, directory=None):
+        self.directory = directory or IMAGECACHEDIR
+        self.indexFile = os.path.join (self.directory, IMAGEINDEXFILE)
+        self.index = {}
+        self.fetched = 0
+        self.stored = 0
+        self.failed = 0
+        try:
+            f = open (self.indexFile)
+            try:
+                self.index = json.load (f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            pass
+
+    def name (self, url):
+        ''' returns the file name the image at url is mirrored as, or None '''
+        name = self.index.get (url)
+        return name and str (name)
+
+    def missing (self, urls):
+        ''' returns those of urls that aren't mirrored yet '''
+        return [url for url in urls if url not in self.index or
+            not os.path.exists (os.path.join (self.directory, self.index[url]))]
+
+    def add (self, url, data):
+        ext = os.path.splitext (urlparse.urlsplit (url).path)[1].lower()
+        name = hashlib.sha1 (data).hexdigest() + ext
+        filename = os.path.join (self.directory, name)
+        if not os.path.exists (filename):
+            f = open (filename + '.tmp', 'wb')
+            try:
+                f.write (data)
+            finally:
+                f.close()
+            replaceFile (filename + '.tmp', filename)
+            self.stored += 1
+        self.index[url] = name
+
+    def save (self):
+        f = open (self.indexFile + '.tmp', 'w')
+        try:
+            json.dump (self.index, f, indent=0, sort_keys=True)
+        finally:
+            f.close()
+        replaceFile (self.indexFile + '.tmp', self.indexFile)
+
+    def prefetch (self, urls, workers=None, timeout=None):
+        ''' mirrors each of urls that isn't already, returning how many were fetched '''
+        if not os.path.isdir (self.directory):
+            os.makedirs (self.directory)
+        todo = self.missing (sorted (set (urls)))
+        for start in xrange (0, len (todo), IMAGE_BATCH):
+            pages = fetchAll (todo[start:start + IMAGE_BATCH], workers, timeout)
+            for (url, page) in pages.iteritems():
+                if page and page[0] == httplib.OK:
+                    self.add (url, page[1])
+                    self.fetched += 1
+                else:
+                    self.failed += 1
+            self.save()
+        g_log.info ("ImageCache: %d images fetched (%d new, %d failed), %d already mirrored",
+            self.fetched, self.stored, self.failed, len (urls) - len (todo))
+        return len (todo)
 
-    m = re.search (r'<span class="XbcFRAR">(?P<gs>\d+)<\/span>', html)
-    if m :
-        return m.group('gs')
+#
+# mirrorForumPost (filename, images, mirrorURL) - rewrites every image in
+#    the forum post filename (see doForums) that images (an ImageCache) has
+#    mirrored to point at the copy under mirrorURL instead.  Only the file
+#    itself is changed: the games and the posted history keep the original URLs
+#
+def mirrorForumPost (filename, images, mirrorURL):
+    base = mirrorURL.rstrip ('/') + '/'
+    def mirror (match):
+        name = images.name (match.group (1))
+        return name and '[IMG]' + base + name + '[/IMG]' or match.group (0)
+
+    f = open (filename, 'rb')
+    try:
+        post = f.read()
+    finally:
+        f.close()
+    f = open (filename, 'wb')
+    try:
+        f.write (IMGTAGREGEX.sub (mirror, post))
+    finally:
+        f.close()
+
+#
+# replaceIfChanged (tmpName, filename) - moves the freshly written file
+#    tmpName over filename, unless filename already has exactly the same
+#    contents (in which case tmpName is just removed, and filename's mtime is
+#    left alone).  Returns whether filename was replaced
+#
+def replaceIfChanged (tmpName, filename):
+    try:
+        same = os.path.getsize (tmpName) == os.path.getsize (filename) and \
+            fileDigest (tmpName) == fileDigest (filename)
+    except OSError:
+        same = False
+
+    if same:
+        os.remove (tmpName)
     else:
-        return "-1"
+        replaceFile (tmpName, filename)
+    return not same
+
+class Watcher (object):
+    '''
+    Keeps the outputs up to date while pages are saved to the current
+    directory (the --watch mode).  Each poll() stats the *.html files, and
+    only those that are new or have changed since they were last read are
+    parsed again; the parsed pages are kept in memory between polls.  Once
+    the directory has gone debounce seconds without a change, CSVFILE and
+    FORUMFILE are regenerated, but each is only rewritten if its contents
+    would change.  A regeneration that fails to read a page (say, one
+    deleted since the scan) is logged and tried again on the next poll.
+    The post is never incremental.  The gamerscore is only fetched again once
+    it is more than gsTTL seconds old, and run() flushes the log after every
+    poll so that progress shows up as it happens.  The achievements of each
+    page read are added to export (an NDJSONExport), if given.
+    '''
+    def __init__ (self, interval=None, debounce=None, gsTTL=None, export=None):
+        self.interval = interval or WATCH_INTERVAL
+        if debounce is None:
+            debounce = WATCH_DEBOUNCE
+        self.debounce = debounce
+        if gsTTL is None:
+            gsTTL = GAMERSCORE_TTL
+        self.gsTTL = gsTTL
+        self.gs = None
+        self.gsFetched = None
+        self.export = export
+        self.cache = g_cache and ParseCache (CACHEFILE, g_cacheSize)
+        self.stats = {}     # file => (size, mtime) when it was last seen
+        self.pages = {}     # file => (gameData, achList), see readGames
+        self.pending = set()
+        self.lastChange = None
+        self.gameImages = None
+
+    def scan (self):
+        stats = {}
+        for file in glob.glob ('*.html'):
+            try:
+                st = os.stat (file)
+            except OSError:
+                continue    # deleted since the glob
+            stats[file] = (st.st_size, st.st_mtime)
+        return stats
+
+    def poll (self, now=None):
+        if now is None:
+            now = time.time()
+
+        stats = self.scan()
+        changed = set ([file for file in stats if self.stats.get (file) != stats[file]])
+        changed.update (set (self.stats) - set (stats))
+        self.stats = stats
+        if changed:
+            self.pending.update (changed)
+            self.lastChange = now
+
+        if self.pending and now - self.lastChange >= self.debounce:
+            try:
+                return self.update (now)
+            except (IOError, OSError), e:
+                # most likely a page renamed or deleted since the scan: the
+                # next poll will see that, and try again
+                g_log.warning ("Watch: %s, will try again", e)
+        return []
+
+    def gamerScore (self, now):
+        ''' returns g_gamertag's gamerscore, fetching it only if the last one fetched is too old '''
+        if self.gs in (None, "-1") or now - self.gsFetched >= self.gsTTL:
+            gs = getGamerScore (g_gamertag)
+            # a failed fetch keeps the last good score, and is retried next time
+            if gs != "-1" or self.gs is None:
+                (self.gs, self.gsFetched) = (gs, now)
+        return self.gs
+
+    def update (self, now=None):
+        if now is None:
+            now = time.time()
+
+        g_log.info ("Watch: %d page(s) changed", len (self.pending))
+        for file in self.pending:
+            self.pages.pop (file, None)
+        games = readGames (sorted (self.stats), cache=self.cache, export=self.export,
+            pages=self.pages)
+        if self.gameImages is None or GAMESFILE in self.pending:
+            self.gameImages = getGameImgs()
+
+        # never incremental: that would mark everything posted on the first
+        # regeneration, and leave nothing in FORUMFILE by the next one
+        doCSVFile (games, filename=CSVFILE + '.tmp')
+        doForums (games, self.gameImages, self.gamerScore (now), incremental=False,
+            filename=FORUMFILE + '.tmp')
+
+        rewritten = [filename for filename in (CSVFILE, FORUMFILE)
+            if replaceIfChanged (filename + '.tmp', filename)]
+        self.pending = set()
+        g_log.info ("Watch: rewrote %s", rewritten and ", ".join (rewritten) or "nothing")
+        return rewritten
+
+    def run (self):
+        g_log.info ("Watch: watching for changed pages (Ctrl-C to stop)...")
+        flushLog()
+        while True:
+            self.poll()
+            flushLog()
+            time.sleep (self.interval)
+
+#
+# loadManifest (filename) - reads the list of profiles for runBatch from the
+#    JSON manifest filename, which looks like:
+#
+#    {"profiles" : [{"name" : "me", "dir" : "pages/me", "gamertag" : "Pedle Zelnip"}, ...]}
+#
+#    A profile's name defaults to its gamertag, and its dir (which is taken
+#    relative to the manifest) to its name.  Returns a list of hashes with
+#    all three set, and dir made absolute
+#
+def loadManifest (filename):
+    f = open (filename)
+    try:
+        manifest = json.load (f)
+    finally:
+        f.close()
+
+    profiles = []
+    for entry in manifest["profiles"]:
+        gamertag = str (entry["gamertag"])
+        name = str (entry.get ("name", gamertag))
+        directory = os.path.join (os.path.dirname (os.path.abspath (filename)),
+            entry.get ("dir", name))
+        profiles.append ({"name" : name, "gamertag" : gamertag, "dir" : directory})
+    return profiles
+
+#
+# runProfile (profile, gs, gameImages, pool) - does everything the script
+#    does for a single profile from loadManifest, reading its pages from and
+#    writing its outputs to its own dir; gs is its gamerscore and gameImages
+#    the TileIndex to take game tiles from.  Pages are parsed on pool (see
+#    parseFiles), if given, and with ndjson set the achievements are
+#    exported to the profile's own NDJSONFILE.  Returns the profile's line
+#    of the batch summary, as a hash
+#
+def runProfile (profile, gs, gameImages, pool=None, ndjson=False):
+    def path (name):
+        return os.path.join (profile["dir"], name)
+
+    g_log.info ("Batch: starting %s...", profile["name"])
+    cache = g_cache and ParseCache (path (CACHEFILE), g_cacheSize)
+    export = ndjson and NDJSONExport (path (NDJSONFILE), path (NDJSONINDEXFILE)) or None
+    try:
+        games = readGames (glob.glob (path ('*.html')), cache=cache, export=export, pool=pool)
+    finally:
+        if export:
+            export.close()
+    doCSVFile (games, filename=path (CSVFILE))
+    doForums (games, gameImages, gs, filename=path (FORUMFILE), postedFile=path (POSTEDFILE))
+    g_log.info ("Batch: finished %s", profile["name"])
+
+    achLists = [gameData["achList"] for gameData in games.itervalues()]
+    times = [ach.ts for achList in achLists for ach in achList]
+    return {"name" : profile["name"], "gamertag" : profile["gamertag"], "gs" : gs,
+        "games" : len (games), "achs" : sum ([len (achList) for achList in achLists]),
+        "achGS" : sum ([ach.gs for achList in achLists for ach in achList]),
+        "latest" : times and utcDate (max (times)) or "-"}
+
+#
+# runBatch (manifestFile, workers, summaryFile, ndjson) - runs every profile
+#    in the manifest manifestFile (see loadManifest), workers (defaults to
+#    BATCH_WORKERS) at a time on a pool of threads.  The threads only
+#    orchestrate: all of their pages are parsed on one shared process pool of
+#    g_workers processes, so the parsing isn't held to one core by the GIL.
+#    The profiles' games pages are all indexed up front and merged into one
+#    TileIndex, so a game's tile is shared by title (normTitle) across
+#    profiles, and the gamerscores are all fetched up front, concurrently (see
+#    getGamerScores).  Each profile gets its own outputs in its dir, and a
+#    table of them all is written to summaryFile (defaults to BATCHSUMMARYFILE
+#    next to the manifest).  ndjson is passed on to runProfile.  Returns the
+#    summary lines
+#
+def runBatch (manifestFile, workers=None, summaryFile=None, ndjson=False):
+    profiles = loadManifest (manifestFile)
+    workers = workers or BATCH_WORKERS
+    summaryFile = summaryFile or os.path.join (os.path.dirname (os.path.abspath (manifestFile)),
+        BATCHSUMMARYFILE)
+
+    tiles = []
+    for profile in profiles:
+        tiles.extend (getGameImgs (os.path.join (profile["dir"], GAMESFILE),
+            os.path.join (profile["dir"], TILEINDEXFILE)).source)
+    gameImages = TileIndex (tiles)
+
+    scores = getGamerScores ([profile["gamertag"] for profile in profiles])
+    parsePool = g_workers > 1 and multiprocessing.Pool (g_workers) or None
+    pool = multiprocessing.pool.ThreadPool (min (workers, len (profiles)) or 1)
+    try:
+        summary = pool.map (lambda profile: runProfile (profile, scores[profile["gamertag"]],
+            gameImages, parsePool, ndjson), profiles)
+    finally:
+        pool.close()
+        pool.join()
+        if parsePool:
+            parsePool.close()
+            parsePool.join()
+
+    f = open (summaryFile, 'w')
+    try:
+        f.write ("%-24s %-16s %10s %6s %8s %8s  %s\n" % ("profile", "gamertag", "gamerscore",
+            "games", "achs", "ach GS", "latest unlock (UTC)"))
+        for line in summary:
+            f.write ("%(name)-24s %(gamertag)-16s %(gs)10s %(games)6d %(achs)8d %(achGS)8d  %(latest)s\n" % line)
+        f.write ("%-24s %-16s %10s %6d %8d %8d\n" % ("total", "", "",
+            sum ([line["games"] for line in summary]), sum ([line["achs"] for line in summary]),
+            sum ([line["achGS"] for line in summary])))
+    finally:
+        f.close()
+    g_log.info ("Batch: %d profiles done, summary in %s", len (summary), summaryFile)
+    return summary
+
+#
+# pagesFingerprint (files) - returns a digest of the names, sizes and
+#    mtimes of files, which changes whenever a page is added, removed,
+#    touched or saved again
+#
+def pagesFingerprint (files):
+    stats = []
+    for file in sorted (files):
+        st = os.stat (file)
+        stats.append ((file, st.st_size, st.st_mtime))
+    return hashlib.md5 (repr (stats)).digest()
+
+#
+# snapshotColumn (typecode, values) - returns an array of values for a
+#    snapshot, checking it is the fixed width (4 bytes) the format needs
+#
+def snapshotColumn (typecode, values=()):
+    column = array.array (typecode, values)
+    if column.itemsize != 4:
+        raise ValueError ("snapshot columns need 4 byte '%s' arrays" % typecode)
+    return column
+
+#
+# saveSnapshot (games, filename, fingerprint) - writes games (as returned by
+#    readGameData) to filename (defaults to SNAPSHOTFILE) in a compact binary
+#    form that loadSnapshot reads back much faster than the pages can be
+#    parsed.  After a SNAPSHOTHEADER, each distinct string is stored once in
+#    a string table (where each starts, plus where the last ends, then all of
+#    their bytes), and
+#    everything else is fixed-width integer columns: for each game, the
+#    string numbers of its gameInfo fields (AchStore.GAMEFIELDS) and its
+#    achievement count, then for all the achievements (game by game) a
+#    column each of name, img and desc string numbers, gs, tcount and ts
+#    (signed, so unlock times must be before 2038).
+#    fingerprint (see pagesFingerprint) is stored so the snapshot can be
+#    checked against the pages it came from
+#
+def saveSnapshot (games, filename=None, fingerprint=None):
+    filename = filename or SNAPSHOTFILE
+    strings = {}
+    def stringNumber (s):
+        n = strings.get (s)
+        if n is None:
+            n = strings[s] = len (strings)
+        return n
+
+    gameColumn = snapshotColumn ('I')
+    achColumns = [snapshotColumn (typecode) for typecode in "IIIiii"]
+    for key in sorted (games.keys()):
+        gameInfo = games[key]["gameInfo"]
+        achList = games[key]["achList"]
+        gameColumn.extend ([stringNumber (gameInfo[field]) for field in AchStore.GAMEFIELDS])
+        gameColumn.append (len (achList))
+        for ach in achList:
+            achColumns[0].append (stringNumber (ach.name))
+            achColumns[1].append (stringNumber (ach.img))
+            achColumns[2].append (stringNumber (ach.desc))
+            achColumns[3].append (ach.gs)
+            achColumns[4].append (ach.tcount)
+            achColumns[5].append (ach.ts)
+
+    table = [None] * len (strings)
+    for (s, n) in strings.iteritems():
+        table[n] = s
+    ends = snapshotColumn ('I', [0])
+    end = 0
+    for s in table:
+        end += len (s)
+        ends.append (end)
+
+    columns = [ends, gameColumn] + achColumns
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+
+    tmpName = filename + '.tmp'
+    f = open (tmpName, 'wb')
+    try:
+        f.write (SNAPSHOTHEADER.pack (SNAPSHOTMAGIC, SNAPSHOTVERSION, PARSERVERSION,
+            fingerprint or '\0' * 16, len (table), end, len (games), len (achColumns[0])))
+        ends.tofile (f)
+        f.write (''.join (table))
+        for column in columns[1:]:
+            column.tofile (f)
+    finally:
+        f.close()
+    replaceFile (tmpName, filename)
+
+#
+# loadSnapshot (filename, fingerprint) - reads back the games hash saved by
+#    saveSnapshot to filename (defaults to SNAPSHOTFILE), with one read of
+#    the whole file.  Raises ValueError, rather than misreading it, if the
+#    file isn't a snapshot, was written by a different SNAPSHOTVERSION or
+#    PARSERVERSION, is truncated, or (if fingerprint is given) was made
+#    from different pages
+#
+def loadSnapshot (filename=None, fingerprint=None):
+    filename = filename or SNAPSHOTFILE
+    f = open (filename, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+
+    if len (data) < SNAPSHOTHEADER.size:
+        raise ValueError ("%s is not a snapshot" % filename)
+    (magic, version, parserVersion, savedFingerprint, stringCount, stringBytes,
+        gameCount, achCount) = SNAPSHOTHEADER.unpack_from (data)
+    if magic != SNAPSHOTMAGIC:
+        raise ValueError ("%s is not a snapshot" % filename)
+    if (version, parserVersion) != (SNAPSHOTVERSION, PARSERVERSION):
+        raise ValueError ("%s is a version %d snapshot of version %d pages, not %d of %d" % \
+            (filename, version, parserVersion, SNAPSHOTVERSION, PARSERVERSION))
+    if fingerprint is not None and fingerprint != savedFingerprint:
+        raise ValueError ("%s was made from different pages" % filename)
+
+    gameWidth = len (AchStore.GAMEFIELDS) + 1
+    if len (data) != SNAPSHOTHEADER.size + 4 * (stringCount + 1) + stringBytes + \
+            4 * (gameCount * gameWidth + achCount * 6):
+        raise ValueError ("%s is truncated" % filename)
+
+    pos = [SNAPSHOTHEADER.size]
+    def read (typecode, count):
+        column = snapshotColumn (typecode)
+        column.fromstring (data[pos[0]:pos[0] + 4 * count])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        pos[0] += 4 * count
+        return column
+
+    ends = read ('I', stringCount + 1)
+    blob = data[pos[0]:pos[0] + stringBytes]
+    pos[0] += stringBytes
+    table = [blob[start:end] for (start, end) in itertools.izip (ends, ends[1:])]
+    gameColumn = read ('I', gameCount * gameWidth)
+    (names, imgs, descs) = [[table[n] for n in read ('I', achCount)] for i in range (3)]
+    (gses, tcounts, tses) = [read ('i', achCount) for i in range (3)]
+
+    games = {}
+    first = 0
+    for i in xrange (0, len (gameColumn), gameWidth):
+        gameInfo = dict ([(field, table[n]) for (field, n) in
+            zip (AchStore.GAMEFIELDS, gameColumn[i:i + gameWidth - 1])])
+        last = first + gameColumn[i + gameWidth - 1]
+        achList = map (Achievement, names[first:last], imgs[first:last], descs[first:last],
+            gses[first:last], tcounts[first:last], tses[first:last])
+        games[gameInfo["key"]] = {"gameInfo" : gameInfo, "achList" : achList}
+        first = last
+    return games
+
+#
+# readGameDataSnapshot (filename, export) - readGameData, but when none of the pages
+#    have changed since the snapshot filename (defaults to SNAPSHOTFILE) was
+#    saved the games are loaded from it instead of the pages.  Otherwise the
+#    pages are read as usual and the snapshot is saved again.  Either way
+#    the achievements are added to export, if given (see NDJSONExport)
+#
+def readGameDataSnapshot (filename=None, export=None):
+    filename = filename or SNAPSHOTFILE
+    fingerprint = pagesFingerprint (glob.glob ('*.html'))
+    try:
+        games = loadSnapshot (filename, fingerprint)
+        g_log.info ('readGameData: loaded %d games from %s', len (games), filename)
+        if export:
+            for gameData in games.itervalues():
+                export.add (gameData["gameInfo"], gameData["achList"])
+        return games
+    except (IOError, ValueError) as e:
+        g_log.info ('readGameData: not using %s: %s', filename, e)
+
+    games = readGameData (export=export)
+    saveSnapshot (games, filename, fingerprint)
+    return games
 
 # the main entry point to the script
 if __name__ == "__main__":
-    gameImages = getGameImgs()
-    games = readGameData()
+    parser = optparse.OptionParser ()
+    parser.add_option ("-e", "--engine", choices=sorted (PARSERS.keys()),
+        default=g_engine, help="page parser to use: stream (default; the faster at scanning "
+        "achievements, and rejects a page without a header at once) or regex")
+    parser.add_option ("--mmap", action="store_true", default=g_mmap,
+        help="memory map pages rather than reading them into memory")
+    parser.add_option ("-v", "--verbose", action="store_const", dest="logLevel",
+        const=logging.DEBUG, default=logging.INFO,
+        help="also print a message for every achievement processed")
+    parser.add_option ("-q", "--quiet", action="store_const", dest="logLevel",
+        const=logging.WARNING, help="don't print progress messages")
+    parser.add_option ("-j", "--workers", type="int", default=g_workers,
+        help="number of processes to parse pages with (default: one per CPU)")
+    parser.add_option ("--chunksize", type="int", default=g_chunksize,
+        help="number of pages handed to a worker at a time (default: automatic)")
+    parser.add_option ("--no-cache", action="store_false", dest="cache",
+        default=g_cache, help="parse every page, ignoring " + CACHEFILE)
+    parser.add_option ("--cache-size", type="int", dest="cacheSize", default=g_cacheSize,
+        help="most parsed pages to keep in the cache (default: %default)")
+    parser.add_option ("--csv-budget", type="int", dest="csvBudget", default=g_csvBudget,
+        help="bytes of CSV lines to sort in memory before using temporary files (default: %default)")
+    parser.add_option ("-i", "--incremental", action="store_true", default=g_incremental,
+        help="only post achievements unlocked since the last post (see " + POSTEDFILE + ")")
+    parser.add_option ("--utc", action="store_true", default=g_utc,
+        help="show unlock times in the forum post in UTC rather than local time")
+    parser.add_option ("-g", "--gamertag", default=g_gamertag,
+        help="gamertag to fetch the total gamerscore of (default: %default)")
+    parser.add_option ("--stats", metavar="FILE",
+        help="time each stage and count what it processed, and save the report to FILE as JSON")
+    parser.add_option ("-w", "--watch", action="store_true", default=False,
+        help="keep running, regenerating the outputs whenever pages are saved")
+    parser.add_option ("--db", metavar="FILE",
+        help="save everything read to the SQLite database FILE (" + DBFILE + " with --from-db)")
+    parser.add_option ("--from-db", action="store_true", dest="fromDB", default=False,
+        help="make the outputs from the database rather than parsing any pages")
+    parser.add_option ("--mirror-images", action="store_true", dest="mirrorImages", default=False,
+        help="download the achievement and game images into " + IMAGECACHEDIR)
+    parser.add_option ("--mirror-url", dest="mirrorURL", metavar="URL",
+        help="download the images (as --mirror-images) and link to them under URL in the forum post")
+    parser.add_option ("--ndjson", action="store_true", default=False,
+        help="append a JSON record to " + NDJSONFILE + " for each achievement not already in it")
+    parser.add_option ("--snapshot", action="store_true", default=False,
+        help="load the games from " + SNAPSHOTFILE + " if no page has changed since it was saved")
+    parser.add_option ("--batch", metavar="MANIFEST",
+        help="run every profile listed in the JSON file MANIFEST (see loadManifest)")
+    parser.add_option ("--batch-workers", type="int", dest="batchWorkers", default=BATCH_WORKERS,
+        help="number of profiles to process at once in --batch mode (default: %default)")
+    (options, args) = parser.parse_args()
+    g_engine = options.engine
+    g_mmap = options.mmap
+    g_workers = options.workers
+    g_chunksize = options.chunksize
+    g_cache = options.cache
+    g_cacheSize = options.cacheSize
+    g_csvBudget = options.csvBudget
+    g_incremental = options.incremental
+    g_utc = options.utc
+    g_gamertag = options.gamertag
+    setupLogging (options.logLevel)
+    if options.stats:
+        g_stats = RunStats()
+
+    if options.batch:
+        if options.stats or options.watch or options.db or options.fromDB or \
+                options.snapshot or options.mirrorImages or options.mirrorURL:
+            parser.error ("--batch can't be used with --stats, --watch, --db, --from-db, "
+                "--snapshot, --mirror-images or --mirror-url")
+        runBatch (options.batch, options.batchWorkers, ndjson=options.ndjson)
+        sys.exit (0)
+
+    if options.watch:
+        if options.stats or options.db or options.fromDB or options.incremental or \
+                options.snapshot or options.mirrorImages or options.mirrorURL:
+            parser.error ("--watch can't be used with --stats, --db, --from-db, --incremental, "
+                "--snapshot, --mirror-images or --mirror-url")
+        export = options.ndjson and NDJSONExport()
+        try:
+            Watcher (export=export or None).run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if export:
+                export.close()
+        sys.exit (0)
+
+    with statStage ("getGameImgs"):
+        gameImages = getGameImgs()
+    store = (options.db or options.fromDB) and AchStore (options.db)
+    export = options.ndjson and NDJSONExport()
+    if options.fromDB:
+        with statStage ("loadGames"):
+            games = store.loadGames()
+            if export:
+                for gameData in games.itervalues():
+                    export.add (gameData["gameInfo"], gameData["achList"])
+    else:
+        with statStage ("readGameData"):
+            if options.snapshot:
+                games = readGameDataSnapshot (export=export)
+            else:
+                games = readGameData (export=export)
+        if store:
+            with statStage ("saveGames"):
+                store.save (games)
+    if export:
+        export.close()
 
     #pp = pprint.PrettyPrinter (4)
     #pp.pprint (games)
 
-    printIndent ("Creating CSV File...")
-    doCSVFile (games)
-    printIndent ("Creating forum post...")
-    doForums (games, gameImages, getGamerScore("Pedle Zelnip"));
+    g_log.info ("Creating CSV File...")
+    with statStage ("doCSVFile"):
+        doCSVFile (games)
+    with statStage ("getGamerScore"):
+        gs = getGamerScore(g_gamertag)
+    g_log.info ("Creating forum post...")
+    with statStage ("doForums"):
+        doForums (games, gameImages, gs);
+    if options.mirrorImages or options.mirrorURL:
+        g_log.info ("Mirroring images...")
+        with statStage ("mirrorImages"):
+            images = ImageCache()
+            images.prefetch (collectImageURLs (games, gameImages))
+            if options.mirrorURL:
+                mirrorForumPost (FORUMFILE, images, options.mirrorURL)
+    if store:
+        store.close()
+
+    if g_stats:
+        g_stats.save (options.stats)
+        g_log.info ("Saved stats to %s", options.stats)
 
@@ -0,0 +1,600 @@
+#! /usr/bin/python
+
+'''
+Benchmarks for ripAchs.py.  Builds synthetic xbox.com achievement pages in
+memory and times the different ways ripAchs can process them.  Run with the
+name of a benchmark (or no arguments to run all of them):
+
+    python ripAchsBench.py [parsers]
+
+The pipeline benchmark saves its timings as JSON (--json, default
+ripAchsBench.json) so runs can be compared.  To write a set of synthetic
+pages to a directory to run ripAchs.py on instead:
+
+    python ripAchsBench.py --generate DIR [--games N] [--achs N] [--filler N]
+'''
+
+import os
+import sys
+import re
+import shutil
+import tempfile
+import subprocess
+import threading
+import time
+import calendar
+import json
+import optparse
+import platform
+import BaseHTTPServer
+import SocketServer
+from timeit import Timer
+
+import ripAchs
+
+# the filler line that pads out a page so the header/achievements are
+# surrounded by the usual xbox.com markup
+FILLER = '<div class="XbcNavItem"><a href="http://live.xbox.com/">Home</a></div>'
+
+# when the newest achievement on a page was unlocked, and how many seconds
+# before that each later row on the page was, so rows come newest-first as
+# they do on xbox.com
+ROWNEWEST = calendar.timegm ((2009, 12, 31, 23, 59, 0))
+ROWSTEP = 53 * 60
+
+def makeAchRow (i):
+    ''' returns the HTML for the i'th achievement of a page '''
+    t = time.gmtime (ROWNEWEST - i * ROWSTEP)
+    return ('<tbody id="ad_%d"><tr><td class="XbcAchDescription"><div class="XbcProfileImageDescCell">'
+        '<img src="http://tiles.xbox.com/tiles/Ab/%d.jpg" /><p><strong class="XbcAchievementsTitle">'
+        'Achievement &amp; %d</strong><br />Unlock &quot;thing&quot; number %d</p></div></td>'
+        '<td class="XbcAchGamerData"><strong>%d <img src="/xweb/lib/images/G_Icon_External.gif" />'
+        '</strong><br /><strong>Acquired <script type="text/javascript">\n    <!--\n'
+        '    _xbcDisplayDate(%d, %d, %d, %d, %d);\n    --></script><noscript>%d/%d/%d'
+        '</noscript></strong></td></tr></tbody>') % \
+        (i % 100, i, i, i, 10 * (1 + i % 5), t.tm_mon - 1, t.tm_mday, t.tm_year, t.tm_hour, t.tm_min,
+        t.tm_mon, t.tm_mday, t.tm_year)
+
+def makeGamePage (title, achCount, fillerLines=200, oneLine=False):
+    ''' returns a complete achievements page for the game title with achCount achievements '''
+    header = ('<div class="XbcProfileHead"><span class="XbcLiveText">%s</span><h2>Achievements</h2></div>'
+        '<div class="XbcAchPercentageBar"><div><div style="width:50%%;"></div></div><p>50%% Unlocked</p></div>'
+        '</div><div class="XbcProfileSubHead"><p class="XbcFloatLeft"><strong>%d of %d '
+        '<img src="/xweb/lib/images/G_Icon_External.gif" /></strong><br /><strong>%d of %d Achievements'
+        '</strong></p><div class="XbcFloatClear"></div></div><div class="XbcProfileTableContainer">'
+        '<table class="XbcProfileTable XbcAchievementsDetailsTable" cellpadding="0" cellspacing="0"><thead>'
+        '<tr class="XbcTableColumns"><th class="XbcAchCol1"><span class="XbcDisplayNone">Achievements </span>'
+        '</th><th class="XbcAchCol2"><span class="XbcDisplayNone">Gamerscore </span></th></tr></thead>') % \
+        (title, achCount * 10, achCount * 20, achCount, achCount * 2)
+
+    sep = oneLine and '' or '\n'
+    filler = sep.join ([FILLER] * fillerLines)
+    return sep.join ([filler, header + ''.join ([makeAchRow (i) for i in range (achCount)]),
+        '</table>', filler])
+
+def makeGamesRow (title, i):
+    ''' returns the HTML for the i'th game (title) of a games page '''
+    return ('<tbody id="ab_%08d"><tr onclick="XbcGetFirstChildHref(this);" '
+        'onMouseOver="XbcNav_swapclass(this, \'XbcProfileHighlight\', \'\');" '
+        'onMouseOut="XbcNav_swapclass(this,\'XbcProfileHighlight\',\'\');"><td class="XbcAchGameCell">'
+        '<div class="XbcProfileImageDescCell"><img class="AchievementsGameIcon" '
+        'src="http://tiles.xbox.com/tiles/Gm/%d.jpg" alt="%s" /><p><a href="http://live.xbox.com/en-US/'
+        'profile/Achievements/ViewAchievementDetails.aspx?tid=%d"><strong class="XbcAchievementsTitle">'
+        '%s</strong></a><br /><strong>Last Played Online: 1/1/2009</strong></p></div></td></tr></tbody>') % \
+        (i, i, title, i, title)
+
+def makeGamesPage (titles, fillerLines=200):
+    ''' returns a games page (ripAchs.GAMESFILE) listing every game in titles '''
+    filler = '\n'.join ([FILLER] * fillerLines)
+    return '\n'.join ([filler] + [makeGamesRow (title, i) for (i, title) in enumerate (titles)] + [filler])
+
+def writePages (dirName, gameCount, achCount, fillerLines=200):
+    '''
+    writes a games page and one achievements page per game (achCount
+    achievements each) to dirName, and returns the game titles
+    '''
+    titles = ["Benchmark Game %d" % i for i in range (gameCount)]
+    for (i, title) in enumerate (titles):
+        f = open (os.path.join (dirName, "game%04d.html" % i), "w")
+        f.write (makeGamePage (title, achCount, fillerLines))
+        f.close()
+
+    f = open (os.path.join (dirName, ripAchs.GAMESFILE), "w")
+    f.write (makeGamesPage (titles, fillerLines))
+    f.close()
+    return titles
+
+def bestOf (fn, repeat=3):
+    ''' returns the best time (in seconds) of repeat calls to fn '''
+    return min (Timer (fn).repeat (repeat, 1))
+
+def benchParsers ():
+    ''' compares the regex and stream page parsers on increasingly large pages '''
+    layouts = [("lines", False, True), ("1 line", True, True), ("no header", True, False)]
+
+    print "%-8s %-10s %12s %12s %8s" % ("achs", "layout", "regex (s)", "stream (s)", "speedup")
+    for achCount in (10, 100, 1000, 5000):
+        for (layout, oneLine, hasHeader) in layouts:
+            html = makeGamePage ("Benchmark Game", achCount, oneLine=oneLine)
+            if not hasHeader:
+                # eg. an unrelated page, or one saved before it finished loading
+                html = html.replace (ripAchs.LIVETEXTTAG, '<span>')
+            if ripAchs.parseRegex (html) != ripAchs.parseStream (html):
+                raise AssertionError ("parsers disagree on %d achievements" % achCount)
+
+            regexTime = bestOf (lambda: ripAchs.parseRegex (html))
+            streamTime = bestOf (lambda: ripAchs.parseStream (html))
+            print "%-8d %-10s %12.4f %12.4f %7.1fx" % (achCount, layout,
+                regexTime, streamTime, regexTime / streamTime)
+
+def replaceHTMLSequential (s):
+    ''' the old replaceHTML: one re.sub per named code (numeric codes left out, they used to crash) '''
+    for (code, val) in ripAchs.HTMLCODES.iteritems():
+        s = re.sub ('&' + code + ';', val, s)
+    return s
+
+def benchDecode ():
+    ''' compares decoding HTML character codes one code at a time, per string and in a batch '''
+    def perString ():
+        ripAchs.g_htmlCache.clear()
+        return [ripAchs.replaceHTML (s) for s in strs]
+
+    def batch ():
+        ripAchs.g_htmlCache.clear()
+        return ripAchs.replaceHTMLList (strs)
+
+    print "%-8s %14s %14s %14s %14s" % ("strings", "sequential (s)", "per string (s)", "batch (s)", "cached (s)")
+    for count in (100, 1000, 10000):
+        strs = ['Achievement &amp; %d &eacute;' % (i % 500) for i in range (count)] + \
+            ['Unlock &quot;thing&quot; number %d' % (i % 500) for i in range (count)]
+        if [replaceHTMLSequential (s) for s in strs] != batch() or perString() != batch():
+            raise AssertionError ("decoders disagree on %d strings" % count)
+
+        print "%-8d %14.4f %14.4f %14.4f %14.4f" % (len (strs),
+            bestOf (lambda: [replaceHTMLSequential (s) for s in strs]),
+            bestOf (perString), bestOf (batch),
+            bestOf (lambda: ripAchs.replaceHTMLList (strs)))
+
+def stripExtraASCIIReduce (s):
+    ''' the old stripExtraASCII, which builds the result up one character at a time '''
+    return reduce (lambda x,y: x + y, 
+        filter (lambda x: ord(x) >= 26 and ord(x) <= 126, list (s)))
+
+def benchStrip ():
+    ''' times stripExtraASCII at page sized inputs: the time per character should stay flat '''
+    print "%-8s %16s %16s %16s" % ("chars", "reduce (ns/char)", "str (ns/char)", "bytes (ns/char)")
+    for size in (1000, 10000, 100000, 1000000):
+        page = makeGamePage ("Benchmark Game \xae", 100)
+        s = (page * (size // len (page) + 1))[:size]
+        b = bytearray (s)
+        if str (ripAchs.stripExtraASCII (b)) != ripAchs.stripExtraASCII (s):
+            raise AssertionError ("str and bytes results differ at %d chars" % size)
+
+        # the old version is quadratic, don't wait for it on the biggest input
+        if size <= 100000:
+            old = "%16.1f" % (bestOf (lambda: stripExtraASCIIReduce (s), 1) / size * 1e9)
+        else:
+            old = "%16s" % "-"
+        print "%-8d %s %16.1f %16.1f" % (size, old,
+            bestOf (lambda: ripAchs.stripExtraASCII (s)) / size * 1e9,
+            bestOf (lambda: ripAchs.stripExtraASCII (b)) / size * 1e9)
+
+    titles = ["Game Title &#174; %d\xae" % i for i in range (100000)]
+    print
+    print "%d titles: one at a time %.4fs, as a column %.4fs" % (len (titles),
+        bestOf (lambda: [ripAchs.stripExtraASCII (t) for t in titles]),
+        bestOf (lambda: ripAchs.stripExtraASCIIList (titles)))
+
+# run in a fresh interpreter by benchMmap to measure the peak RSS of parsing one page
+MAXRSSSCRIPT = """
+import sys, resource
+import ripAchs
+ripAchs.doFile (sys.argv[1], mapped=(sys.argv[2] == "1"))
+print resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+"""
+
+def benchMmap ():
+    ''' compares the peak RSS (and time) of parsing increasingly large pages read vs memory mapped '''
+    tmpDir = tempfile.mkdtemp()
+    try:
+        print "%-8s %14s %14s %10s %10s" % ("page MB", "read (KB RSS)", "mmap (KB RSS)", "read (s)", "mmap (s)")
+        for fillerLines in (1000, 100000, 400000):
+            filename = os.path.join (tmpDir, "page.html")
+            f = open (filename, "w")
+            f.write (makeGamePage ("Benchmark Game", 1000, fillerLines=fillerLines))
+            f.close()
+
+            rss = []
+            for mapped in ("0", "1"):
+                out = subprocess.Popen ([sys.executable, "-c", MAXRSSSCRIPT, filename, mapped],
+                    stdout=subprocess.PIPE, cwd=os.path.dirname (os.path.abspath (__file__))).communicate()[0]
+                rss.append (int (out))
+
+            print "%-8.1f %14d %14d %10.4f %10.4f" % (os.path.getsize (filename) / 1048576.0,
+                rss[0], rss[1], bestOf (lambda: ripAchs.doFile (filename, mapped=False)),
+                bestOf (lambda: ripAchs.doFile (filename, mapped=True)))
+    finally:
+        shutil.rmtree (tmpDir)
+
+# run in a fresh interpreter by benchMemory: builds COUNT achievements the old
+# way (one hash of strings each) or as ripAchs.Achievement records, from 50
+# snapshots' worth of repeated names, and prints how much the current RSS
+# (not the peak, which importing may already have pushed higher) grew by,
+# and the sys.getsizeof total of the records and everything they hold (each
+# object counted once), both in bytes
+MEMORYSCRIPT = """
+import sys, os, gc
+import ripAchs
+
+def currentRSS ():
+    f = open ('/proc/self/statm')
+    try:
+        return int (f.read().split()[1]) * os.sysconf ('SC_PAGE_SIZE')
+    finally:
+        f.close()
+
+def makeAchHash (tcount, img, name, desc, gs, month, day, year, hour, min):
+    ach = {'name' : name, 'img' : img, 'desc' : desc, 'gs' : gs, 'tcount' : tcount,
+        'month' : ripAchs.padZero (str (int (month) + 1)), 'day' : ripAchs.padZero (day),
+        'year' : year, 'hour' : ripAchs.padZero (hour), 'min' : ripAchs.padZero (min)}
+    ach['date'] = ach["year"] + " " + ach["month"] + " " + ach["day"] + " " + \\
+        ach["hour"] + ":" + ach["min"] + ":00"
+    return ach
+
+def contents (record):
+    if isinstance (record, dict):
+        return record.values()
+    return [getattr (record, slot) for slot in record.__slots__]
+
+make = sys.argv[1] == "hash" and makeAchHash or ripAchs.makeAch
+count = int (sys.argv[2])
+gc.collect()
+before = currentRSS()
+achs = []
+for i in xrange (count):
+    # strings built fresh each time, as they are when they're matched out of a page
+    j = i % (count // 50)
+    achs.append (make (999 - i, "http://tiles.xbox.com/tiles/Ab/%d.jpg" % j,
+        "Achievement %d" % j, "Unlock thing number %d" % j, str (10 + i % 5),
+        str (i % 12), str (1 + i % 28), "2009", str (i % 24), str (i % 60)))
+gc.collect()
+rss = currentRSS() - before
+
+seen = {}
+for ach in achs:
+    for obj in [ach] + contents (ach):
+        seen[id (obj)] = sys.getsizeof (obj)
+print rss, sum (seen.itervalues())
+"""
+
+def benchMemory ():
+    ''' compares the memory used by 100k achievements stored as hashes and as Achievements '''
+    if not os.path.exists ('/proc/self/statm'):
+        print "needs /proc/self/statm (Linux) to read the current RSS"
+        return
+
+    count = 100000
+    used = {}
+    print "%-12s %12s %14s %12s %14s" % ("form", "RSS (KB)", "RSS (B/ach)", "sizeof (KB)", "sizeof (B/ach)")
+    for form in ("hash", "Achievement"):
+        out = subprocess.Popen ([sys.executable, "-c", MEMORYSCRIPT, form, str (count)],
+            stdout=subprocess.PIPE, cwd=os.path.dirname (os.path.abspath (__file__))).communicate()[0]
+        (rss, sizes) = [int (n) for n in out.split()]
+        used[form] = (rss, sizes)
+        print "%-12s %12d %14d %12d %14d" % (form, rss // 1024, rss // count,
+            sizes // 1024, sizes // count)
+    print "saving: %.1fx RSS, %.1fx sizeof" % (float (used["hash"][0]) / used["Achievement"][0],
+        float (used["hash"][1]) / used["Achievement"][1])
+
+def benchAggregate ():
+    ''' times AchColumns.aggregate in plain Python and (if it's installed) with NumPy '''
+    groupings = [('day', 'game'), ('week',), ('month', 'game')]
+
+    print "%-8s %-14s %12s %12s" % ("achs", "group by", "python (s)", "numpy (s)")
+    for count in (1000, 100000, 1000000):
+        columns = ripAchs.AchColumns()
+        for i in xrange (count):
+            columns.game.append (i % 300)
+            columns.day.append (20050101 + (i // 28 % 12) * 100 + i % 28)
+            columns.gs.append (5 * (1 + i % 10))
+        columns.titles = ["Game %d" % i for i in range (300)]
+
+        for by in groupings:
+            python = bestOf (lambda: columns.aggregate (by, vectorized=False))
+            if ripAchs.numpy is not None:
+                vectorized = "%12.4f" % bestOf (lambda: columns.aggregate (by, vectorized=True))
+            else:
+                vectorized = "%12s" % "-"
+            print "%-8d %-14s %12.4f %s" % (count, ",".join (by), python, vectorized)
+
+class StandInHandler (BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves canned responses for a StandInServer: server.pages maps a path to
+    its body, and anything else is a 404.  Each response is held back by
+    server.delay seconds to stand in for the round trip to xbox.com, and
+    keep-alive (HTTP/1.1) connections are supported.
+    '''
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1   # send each response in one go (flushed after every request)
+
+    def setup (self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup (self)
+        self.server.connections += 1
+
+    def do_GET (self):
+        time.sleep (self.server.delay)
+        body = self.server.pages.get (self.path)
+        self.send_response (body is None and 404 or 200)
+        self.send_header ("Content-Length", str (len (body or "")))
+        self.end_headers()
+        self.wfile.write (body or "")
+
+    def log_message (self, *args):
+        pass
+
+class StandInServer (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    ''' local stand-in for an xbox.com server, run on a background thread (see StandInHandler) '''
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__ (self, pages, delay=0.0):
+        BaseHTTPServer.HTTPServer.__init__ (self, ("127.0.0.1", 0), StandInHandler)
+        self.pages = pages
+        self.delay = delay
+        self.connections = 0
+        thread = threading.Thread (target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def url (self, path=""):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+def makeGamercard (gs):
+    ''' returns a gamercard page showing the gamerscore gs '''
+    return '<div class="XbcGamercard"><span class="XbcFRAR">%d</span></div>' % gs
+
+def benchFetch ():
+    ''' fetches gamercards for many gamertags from a local stand-in server with 50ms of latency '''
+    gamers = ["Gamer %d" % i for i in range (48)]
+    pages = dict ([("/%s.card" % ripAchs.spacesToPlus (g), makeGamercard (1000 + i)) for (i, g) in enumerate (gamers)])
+    server = StandInServer (pages, delay=0.05)
+    try:
+        print "%-8s %10s %12s" % ("workers", "time (s)", "connections")
+        for workers in (1, 4, 16):
+            server.connections = 0
+            start = time.time()
+            scores = ripAchs.getGamerScores (gamers + ["Nobody"], workers=workers, cardURL=server.url ("/%s.card"))
+            elapsed = time.time() - start
+            if scores["Nobody"] != "-1" or [scores[g] for g in gamers] != [str (1000 + i) for i in range (len (gamers))]:
+                raise AssertionError ("wrong gamerscores with %d workers" % workers)
+            print "%-8d %10.3f %12d" % (workers, elapsed, server.connections)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def doForumsConcat (games, gameImages, gs, filename):
+    ''' the old doForums (less incremental mode): builds each piece with +, and writes it straight away '''
+    indexes = [ripAchs.getAchIndex (gameData) for gameData in games.itervalues()]
+    times = [index.times[i] for index in indexes for i in (0, -1) if index.times]
+    clock = ripAchs.LocalTime (min (times or [0]), max (times or [-1]), ripAchs.g_utc)
+    GICONURL = ripAchs.GICONURL
+
+    toPost = []
+    for (title, gameData) in games.iteritems():
+        achs = ripAchs.getAchIndex (gameData).latestDay (clock)
+        achs.reverse()
+        toPost.append ((title, gameData, achs))
+
+    postIncrease = 0
+    f = open (filename, 'w')
+    for (title, gameData, todaysAchs) in toPost:
+        gameInfo = gameData["gameInfo"]
+        f.write ('[CENTER]' + '[SIZE="3"][b]' + gameInfo["title"] + '[/b][/SIZE]\n' + \
+            gameInfo["achCount"] + ' / ' + gameInfo["achTotal"] + ' (' + gameInfo["percent"] + \
+            '%) achievements for ' + gameInfo["gs"] + ' / ' + gameInfo["gstotal"] + \
+            '[IMG]' + GICONURL + '[/IMG] (' + \
+            str(round(float(gameInfo["gs"]) / float(gameInfo["gstotal"]) * 100.0, 1)) + '%)[/CENTER]')
+        f.write ('\n\n')
+
+        total = 0
+        for ach in todaysAchs:
+            f.write('[IMG]' + ach["img"] + '[/IMG]\n[b]' + \
+                ach["name"] + '[/b] - ' + ach["desc"] + \
+                ' (' + str(ach["gs"]) + ' [IMG]' + \
+                GICONURL + '[/IMG]) (Acquired ' + \
+                clock.format (ach.ts) + \
+                ')\n\n')
+            total += int(ach["gs"])
+
+        if len (toPost) > 1:
+            f.write('[SIZE="2"][CENTER]Total GS for day in ' + \
+                gameInfo["title"] + ': ' + str(total) + ' [IMG]' + \
+                GICONURL + '[/IMG][/CENTER][/SIZE]\n\n')
+        f.write ('[CENTER]------------------------------------[/CENTER]\n\n')
+        postIncrease = postIncrease + total
+
+    f.write ('[SIZE="3"][CENTER]Total increase in GS in this update: ' + \
+        str(postIncrease) + ' [IMG]' + GICONURL + '[/IMG]\nNew Total GS: ' + \
+        ripAchs.commify(str(gs)) + ' [IMG]' +  GICONURL + '[/IMG][/CENTER][/SIZE]\n\n')
+    f.close()
+
+def benchForums ():
+    ''' compares rendering forum posts of thousands of achievements (all unlocked on one day) with + and from templates '''
+    tmpDir = tempfile.mkdtemp()
+    try:
+        (oldName, newName) = (os.path.join (tmpDir, "old.txt"), os.path.join (tmpDir, "new.txt"))
+        print "%-8s %-6s %12s %14s %8s" % ("achs", "games", "concat (s)", "template (s)", "speedup")
+        for (achTotal, gameCount) in ((1000, 1), (1000, 10), (10000, 10), (100000, 20)):
+            games = {}
+            for g in range (gameCount):
+                title = "Benchmark Game &amp; %d" % g
+                achList = ripAchs.makeAchList ([("http://tiles.xbox.com/tiles/Ab/%d.jpg" % i,
+                    "Achievement &amp; %d" % i, "Unlock &quot;thing&quot; number %d" % i,
+                    str (5 * (1 + i % 10)), "5", "14", "2009", str (i // 60 % 24), str (i % 60))
+                    for i in range (achTotal // gameCount)])
+                gameData = ripAchs.makeGameData (title, "50", "500", "1000", str (len (achList)), "100")
+                games[gameData["key"]] = {"gameInfo" : gameData, "achList" : achList}
+
+            doForumsConcat (games, ripAchs.TileIndex(), 123456, oldName)
+            ripAchs.doForums (games, ripAchs.TileIndex(), 123456, incremental=False, filename=newName)
+            if open (oldName, "rb").read() != open (newName, "rb").read():
+                raise AssertionError ("posts differ for %d achievements" % achTotal)
+
+            concat = bestOf (lambda: doForumsConcat (games, ripAchs.TileIndex(), 123456, oldName))
+            template = bestOf (lambda: ripAchs.doForums (games, ripAchs.TileIndex(), 123456,
+                incremental=False, filename=newName))
+            print "%-8d %-6d %12.4f %14.4f %7.1fx" % (achTotal, gameCount, concat, template,
+                concat / template)
+    finally:
+        shutil.rmtree (tmpDir)
+
+def benchImages ():
+    ''' mirrors 400 images (100 distinct) from a stand-in server with 20ms of latency, then checks the rewritten post '''
+    pages = dict ([("/tiles/%d.jpg" % i, "JFIF image %d" % (i % 100)) for i in range (400)])
+    server = StandInServer (pages, delay=0.02)
+    tmpDir = tempfile.mkdtemp()
+    try:
+        games = {}
+        for g in range (4):
+            achList = ripAchs.makeAchList ([(server.url ("/tiles/%d.jpg" % (g * 100 + i)), "Ach %d" % i,
+                "Desc", "10", "5", "14", "2009", "12", str (i % 60)) for i in range (100)])
+            gameData = ripAchs.makeGameData ("Game %d" % g, "50", "500", "1000", "100", "100")
+            games[gameData["key"]] = {"gameInfo" : gameData, "achList" : achList}
+        urls = ripAchs.collectImageURLs (games, ripAchs.TileIndex())
+        urls.append (server.url ("/missing.jpg"))
+
+        print "%-8s %-6s %10s %8s %8s %8s %8s" % ("workers", "run", "time (s)", "fetched", "stored",
+            "failed", "files")
+        for workers in (1, 8):
+            cacheDir = os.path.join (tmpDir, "images%d" % workers)
+            for run in ("cold", "warm"):
+                images = ripAchs.ImageCache (cacheDir)
+                start = time.time()
+                images.prefetch (urls, workers=workers)
+                print "%-8d %-6s %10.3f %8d %8d %8d %8d" % (workers, run, time.time() - start,
+                    images.fetched, images.stored, images.failed, len (os.listdir (cacheDir)) - 1)
+            if images.stored or len (os.listdir (cacheDir)) != 101:
+                raise AssertionError ("images weren't stored once each with %d workers" % workers)
+
+        post = os.path.join (tmpDir, "out.txt")
+        ripAchs.doForums (games, ripAchs.TileIndex(), 0, incremental=False, filename=post)
+        ripAchs.mirrorForumPost (post, images, "http://mirror.example/ach/")
+        mirrored = open (post).read()
+        if server.url() in mirrored or "[IMG]http://mirror.example/ach/" not in mirrored:
+            raise AssertionError ("forum post images weren't rewritten")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree (tmpDir)
+
+def benchSnapshot ():
+    ''' compares starting up from the pages, from the parse cache and from a snapshot '''
+    cwd = os.getcwd()
+    tmpDir = tempfile.mkdtemp()
+    try:
+        os.chdir (tmpDir)
+        print "%-8s %10s %10s %12s %12s" % ("achs", "parse (s)", "cache (s)", "snapshot (s)", "snapshot KB")
+        for achTotal in (1000, 10000, 100000):
+            for name in os.listdir (tmpDir):
+                os.remove (name)
+            gameCount = max (1, min (200, achTotal // 50))
+            writePages (tmpDir, gameCount, achTotal // gameCount)
+
+            games = ripAchs.readGameData (cache=False)
+            ripAchs.readGameData()    # fills the parse cache
+            ripAchs.saveSnapshot (games)
+            if ripAchs.loadSnapshot() != games:
+                raise AssertionError ("snapshot differs for %d achievements" % achTotal)
+
+            repeat = achTotal < 100000 and 3 or 1
+            print "%-8d %10.4f %10.4f %12.4f %12d" % (achTotal,
+                bestOf (lambda: ripAchs.readGameData (cache=False), repeat),
+                bestOf (ripAchs.readGameData, repeat), bestOf (ripAchs.loadSnapshot, repeat),
+                os.path.getsize (ripAchs.SNAPSHOTFILE) // 1024)
+    finally:
+        os.chdir (cwd)
+        shutil.rmtree (tmpDir)
+
+# file benchPipeline saves its results to (see --json)
+g_jsonFile = "ripAchsBench.json"
+
+def benchPipeline ():
+    '''
+    times each stage of ripAchs.py end to end on pages written to disk, from
+    10 to 100k achievements, and saves the results to g_jsonFile
+    '''
+    stages = ["getGameImgs", "readGameData", "doCSVFile", "doForums"]
+    results = []
+    cwd = os.getcwd()
+    tmpDir = tempfile.mkdtemp()
+    try:
+        os.chdir (tmpDir)
+        print "%-8s %-6s %10s" % ("achs", "games", "page KB") + \
+            "".join ([" %16s" % (stage + " (s)") for stage in stages])
+        for achTotal in (10, 100, 1000, 10000, 100000):
+            gameCount = max (1, min (200, achTotal // 50))
+            for name in os.listdir (tmpDir):
+                os.remove (name)
+            writePages (tmpDir, gameCount, achTotal // gameCount)
+            pageBytes = sum ([os.path.getsize (name) for name in os.listdir (tmpDir)])
+
+            def getGameImgs ():
+                # time building the index, not loading it
+                if os.path.exists (ripAchs.TILEINDEXFILE):
+                    os.remove (ripAchs.TILEINDEXFILE)
+                return ripAchs.getGameImgs()
+
+            repeat = achTotal < 100000 and 3 or 1
+            games = ripAchs.readGameData (cache=False)
+            gameImages = getGameImgs()
+            if sum ([len (game["achList"]) for game in games.itervalues()]) != achTotal:
+                raise AssertionError ("didn't read back all %d achievements" % achTotal)
+
+            times = {"getGameImgs" : bestOf (getGameImgs, repeat),
+                "readGameData" : bestOf (lambda: ripAchs.readGameData (cache=False), repeat),
+                "doCSVFile" : bestOf (lambda: ripAchs.doCSVFile (games), repeat),
+                "doForums" : bestOf (lambda: ripAchs.doForums (games, gameImages, "0"), repeat)}
+            results.append ({"achs" : achTotal, "games" : gameCount, "pageBytes" : pageBytes,
+                "workers" : ripAchs.g_workers, "seconds" : times})
+            print "%-8d %-6d %10d" % (achTotal, gameCount, pageBytes // 1024) + \
+                "".join ([" %16.4f" % times[stage] for stage in stages])
+    finally:
+        os.chdir (cwd)
+        shutil.rmtree (tmpDir)
+
+    f = open (g_jsonFile, "w")
+    json.dump ({"benchmark" : "pipeline", "time" : time.strftime ("%Y-%m-%dT%H:%M:%S"),
+        "python" : platform.python_version(), "platform" : platform.platform(),
+        "results" : results}, f, indent=2, sort_keys=True)
+    f.close()
+    print "saved to", g_jsonFile
+
+BENCHMARKS = {"parsers" : benchParsers, "decode" : benchDecode, "strip" : benchStrip,
+    "mmap" : benchMmap, "memory" : benchMemory, "aggregate" : benchAggregate,
+    "fetch" : benchFetch, "pipeline" : benchPipeline, "forums" : benchForums,
+    "snapshot" : benchSnapshot, "images" : benchImages}
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser (usage="%prog [options] [benchmark ...]")
+    parser.add_option ("--json", default=g_jsonFile,
+        help="file the pipeline benchmark saves its results to (default: %default)")
+    parser.add_option ("--generate", metavar="DIR",
+        help="write synthetic pages to DIR instead of running benchmarks")
+    parser.add_option ("--games", type="int", default=10,
+        help="number of games to --generate (default: %default)")
+    parser.add_option ("--achs", type="int", default=50,
+        help="number of achievements per game to --generate (default: %default)")
+    parser.add_option ("--filler", type="int", default=200,
+        help="lines of filler markup around each --generate'd page (default: %default)")
+    (options, args) = parser.parse_args()
+    g_jsonFile = options.json
+
+    if options.generate:
+        if not os.path.isdir (options.generate):
+            os.makedirs (options.generate)
+        writePages (options.generate, options.games, options.achs, options.filler)
+        sys.exit (0)
+
+    for name in args or sorted (BENCHMARKS.keys()):
+        print "== %s ==" % name
+        BENCHMARKS[name]()